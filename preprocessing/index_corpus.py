@@ -0,0 +1,51 @@
+"""Indexes whole-corpus, lemmatized+tagged files (prepared for w2v) by lemma,
+as an alternative to materializing target-level files (for BERT). Contexts of
+any target can then be read on demand with utils.sentence_index.ContextReader."""
+import argparse
+import logging
+import os
+
+import sys
+sys.path.append('../')
+from utils.columnar_corpus import COLS_EXT, ColumnarCorpus
+from utils.sentence_index import INDEX_EXT, SentenceIndex
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('in_dir', help='one-sentence-per-line corpus')
+    parser.add_argument('out_dir', help=f'where to write {INDEX_EXT} indexes')
+    parser.add_argument('--columnar', help=f'index columnar corpora ({COLS_EXT}) '
+                        'from in_dir instead of .txt.gz files',
+                        action='store_true')
+    args = parser.parse_args()
+
+    in_dir = args.in_dir
+    out_dir = args.out_dir
+    columnar = args.columnar
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+
+    in_files = os.listdir(in_dir)
+    in_ext = COLS_EXT if columnar else '.txt.gz'
+    in_files = [f for f in in_files if f.endswith(in_ext)]
+    in_files = sorted(in_files)
+
+    for in_file in in_files:
+
+        out_file = os.path.join(out_dir, in_file[:-len(in_ext)] + INDEX_EXT)
+        if os.path.exists(out_file):
+            raise ValueError('Output index already exists.')
+
+        in_path = os.path.join(in_dir, in_file)
+        if columnar:
+            index = SentenceIndex.from_columnar(ColumnarCorpus(in_path))
+        else:
+            index = SentenceIndex.from_text(in_path)
+        index.save(out_file)
+
+        logging.info(f'Indexed {len(index.vocab)} lemmas in '
+                     f'{index.meta["n_sents"]} sentences: {out_file}.')
+
+if __name__ == '__main__':
+    main()
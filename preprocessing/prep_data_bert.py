@@ -0,0 +1,321 @@
+"""Converts whole-corpus, lemmatized+tagged files (prepared for w2v) into
+target-level and constituent-level, lemmatized files (for BERT), reading each
+corpus file only once."""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import re
+from collections import defaultdict, deque
+from itertools import islice
+from smart_open import open
+from writer_pool import WriterPool
+
+import sys
+sys.path.append('../')
+from utils.columnar_corpus import COLS_EXT, ColumnarCorpus, read_meta
+from utils.load_targets import load_targets
+
+# Number of lines (sentences) matched at once, e.g. by one worker process
+CHUNK_SIZE = 10000
+
+def get_comp_targets():
+    """Returns the set of underscored target compounds."""
+
+    return set(load_targets())
+
+def get_const_targets():
+    """Returns the set of constituents of the target compounds."""
+
+    return {w for cpd in get_comp_targets() for w in cpd.split('_')}
+
+def format_line(line, target):
+    """Joins a lemmatized sentence, removing underscores from the target."""
+
+    out_line = []
+    for tok in line:
+        if tok == target:
+            tok = tok.replace('_', ' ')
+        out_line.append(tok)
+
+    return ' '.join(out_line) + '\n'
+
+class Reservoir:
+    """Uniform random sample of at most `size` items of a stream.
+
+    Uses reservoir sampling (Algorithm R), with its own seeded random number
+    generator, so that the sample only depends on the seed and the stream.
+
+    Args:
+        size: Maximum number of sampled items.
+        seed: Seed for the random number generator.
+    """
+
+    def __init__(self, size, seed):
+        self.size = size
+        self.rng = random.Random(seed)
+        self.items = []
+        self.n_seen = 0
+
+    def draw(self):
+        """Returns the slot in `items` for the next item of the stream, or
+        None if the item is not sampled."""
+
+        k = self.n_seen
+        self.n_seen += 1
+        if k < self.size:
+            self.items.append(None)
+            return k
+
+        j = self.rng.randrange(k + 1)
+
+        return j if j < self.size else None
+
+def match_lines(lines, start, group_targets):
+    """Finds target sentences in consecutive lines of a text corpus.
+
+    Args:
+        lines: List of corpus lines.
+        start: Line number of the first line.
+        group_targets: List of sets of target lemmas.
+
+    Returns:
+        A list with, for each set of targets, a dictionary from target to a
+        list of (line number, formatted line) pairs, in corpus order.
+    """
+
+    matches = [defaultdict(list) for _ in group_targets]
+    for n, line in enumerate(lines, start):
+        line = [t.split('::')[0] for t in line.split()]
+        lemmas = set(line)
+        for targets, found in zip(group_targets, matches):
+            for target in lemmas & targets:
+                found[target].append((n, format_line(line, target)))
+
+    return matches
+
+def match_sentences(corpus, start, end, group_targets):
+    """Same as `match_lines`, for sentences [start, end) of a ColumnarCorpus."""
+
+    all_targets = set().union(*group_targets)
+    target_ids = corpus.lemma_ids(all_targets)
+    target_sents = corpus.find_sentences(target_ids.values(),
+                                         start=start, end=end)
+
+    matches = [defaultdict(list) for _ in group_targets]
+    for targets, found in zip(group_targets, matches):
+        for target, target_id in target_ids.items():
+            if target not in targets or target_id not in target_sents:
+                continue
+            for i in target_sents[target_id].tolist():
+                line = corpus.sentence_lemmas(i)
+                found[target].append((i, format_line(line, target)))
+
+    return matches
+
+def iter_tasks(in_files, columnar=False, chunk_size=CHUNK_SIZE):
+    """Splits corpus files into chunks that can be matched independently.
+
+    Yields:
+        (file number, chunk) pairs, with at least one chunk per file. Chunks
+        are (start, lines) pairs for text corpora and (path, start, end)
+        sentence ranges for columnar corpora.
+    """
+
+    for file_num, in_file in enumerate(in_files):
+        if columnar:
+            n_sents = read_meta(in_file)['n_sents']
+            for start in range(0, max(n_sents, 1), chunk_size):
+                yield file_num, (in_file, start, start + chunk_size)
+        else:
+            with open(in_file, 'r') as f:
+                start = 0
+                while True:
+                    lines = list(islice(f, chunk_size))
+                    yield file_num, (start, lines)
+                    if len(lines) < chunk_size:
+                        break
+                    start += len(lines)
+
+# Per-process state for chunk matching, set up by `_init_worker`
+_worker_state = {}
+
+def _init_worker(group_targets, columnar):
+    _worker_state['group_targets'] = group_targets
+    _worker_state['columnar'] = columnar
+    _worker_state['corpus'] = None
+
+def _match_task(task):
+    """Matches one chunk from `iter_tasks`, in the current process."""
+
+    file_num, chunk = task
+    group_targets = _worker_state['group_targets']
+
+    if _worker_state['columnar']:
+        in_file, start, end = chunk
+        corpus = _worker_state['corpus']
+        if corpus is None or corpus.path != in_file:
+            corpus = _worker_state['corpus'] = ColumnarCorpus(in_file)
+        return file_num, match_sentences(corpus, start, end, group_targets)
+
+    start, lines = chunk
+    return file_num, match_lines(lines, start, group_targets)
+
+def _imap_bounded(pool, func, tasks, window):
+    """Like pool.imap, but with at most `window` tasks in flight, so that
+    tasks are not read ahead (and kept in memory) faster than they are used."""
+
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+class DecadeWriter:
+    """Writes (or samples) the matched sentences of one decade.
+
+    Args:
+        write_out_dirs: Output directories, one per set of targets.
+        max_open: Maximum number of simultaneously open output files.
+        max_per_target: If set, writes a uniform random sample of at most
+            this many sentences per target, in corpus order.
+        seed: Seed for sampling, combined with each target.
+    """
+
+    def __init__(self, write_out_dirs, max_open=256, max_per_target=None,
+                 seed=''):
+        group_max_open = max(1, max_open // len(write_out_dirs))
+        self.pools = [WriterPool(d, max_open=group_max_open)
+                      for d in write_out_dirs]
+        self.max_per_target = max_per_target
+        self.seed = seed
+        self.samples = [{} for _ in write_out_dirs]
+
+    def add(self, matches):
+        """Adds the matches of the next chunk (see `match_lines`)."""
+
+        for pool, samples, found in zip(self.pools, self.samples, matches):
+            for target, out_lines in found.items():
+                if self.max_per_target is None:
+                    pool.write(target, ''.join(l for _, l in out_lines))
+                    continue
+                if target not in samples:
+                    samples[target] = Reservoir(self.max_per_target,
+                                                f'{self.seed}:{target}')
+                sample = samples[target]
+                for item in out_lines:
+                    slot = sample.draw()
+                    if slot is not None:
+                        sample.items[slot] = item
+
+    def close(self):
+        # Samples are only complete at the end of the decade
+        for pool, samples in zip(self.pools, self.samples):
+            for target in sorted(samples):
+                out_lines = sorted(samples[target].items)
+                pool.write(target, ''.join(l for _, l in out_lines))
+            pool.close()
+
+def extract(in_dir, outputs, columnar=False, max_open=256,
+            max_per_target=None, seed=0, jobs=1):
+    """Extracts target-level files for every decade in a single pass each.
+
+    Args:
+        in_dir: Directory with the one-sentence-per-line corpus.
+        outputs: List of (targets, out_dir) pairs; for each decade, files for
+            the targets are written to a new <out_dir>/<decade> directory.
+        columnar: If true, reads columnar corpora instead of .txt.gz files.
+        max_open: Maximum number of simultaneously open output files.
+        max_per_target: If set, keeps a reproducible random sample of at most
+            this many sentences per target and decade.
+        seed: Seed for sampling.
+        jobs: Number of worker processes matching chunks of the decades;
+            results are written in corpus order, so the output does not
+            depend on this number.
+    """
+
+    in_files = os.listdir(in_dir)
+    in_ext = COLS_EXT if columnar else '.txt.gz'
+    in_files = [f for f in in_files if f.endswith(in_ext)]
+    in_files = sorted(in_files)
+
+    years = [re.search(r'\d+', in_file).group() for in_file in in_files]
+    for year in years:
+        for _, out_dir in outputs:
+            if os.path.isdir(os.path.join(out_dir, year)):
+                raise ValueError('Output directory already exists.')
+
+    group_targets = [targets for targets, _ in outputs]
+    tasks = iter_tasks([os.path.join(in_dir, f) for f in in_files],
+                       columnar=columnar)
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, initializer=_init_worker,
+                                    initargs=(group_targets, columnar))
+        results = _imap_bounded(pool, _match_task, tasks, window=2*jobs)
+    else:
+        pool = None
+        _init_worker(group_targets, columnar)
+        results = map(_match_task, tasks)
+
+    # Chunks arrive in corpus order, decade after decade
+    writer = None
+    current = None
+    try:
+        for file_num, matches in results:
+            if file_num != current:
+                if writer is not None:
+                    writer.close()
+                    logging.info(f'Processed {years[current]}.')
+                current = file_num
+                write_out_dirs = [os.path.join(out_dir, years[current])
+                                  for _, out_dir in outputs]
+                for write_out_dir in write_out_dirs:
+                    os.mkdir(write_out_dir)
+                writer = DecadeWriter(write_out_dirs, max_open=max_open,
+                                      max_per_target=max_per_target,
+                                      seed=f'{seed}:{years[current]}')
+            writer.add(matches)
+        if writer is not None:
+            writer.close()
+            logging.info(f'Processed {years[current]}.')
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('in_dir', help='one-sentence-per-line corpus')
+    parser.add_argument('comp_out_dir', help='where to write target-level files')
+    parser.add_argument('const_out_dir',
+                        help='where to write constituent-level files')
+    parser.add_argument('--columnar', help=f'read columnar corpora ({COLS_EXT}) '
+                        'from in_dir instead of .txt.gz files',
+                        action='store_true')
+    parser.add_argument('--max_open', help='maximum number of simultaneously '
+                        'open output files, default 256', default=256, type=int)
+    parser.add_argument('--max_per_target', '--max-per-target',
+                        help='keep a random sample of at most N sentences per '
+                        'target and decade', metavar='N', type=int)
+    parser.add_argument('--seed', help='seed for sampling, default 0',
+                        default=0, type=int)
+    parser.add_argument('--jobs', help='number of worker processes, default 1',
+                        default=1, type=int)
+    args = parser.parse_args()
+    if args.max_per_target is not None and args.max_per_target < 1:
+        parser.error('--max_per_target must be at least 1')
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+
+    outputs = [(get_comp_targets(), args.comp_out_dir),
+               (get_const_targets(), args.const_out_dir)]
+    extract(args.in_dir, outputs, columnar=args.columnar,
+            max_open=args.max_open, max_per_target=args.max_per_target,
+            seed=args.seed, jobs=args.jobs)
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,30 @@
 """Converts whole-corpus, lemmatized+tagged files (prepared for w2v) into
 consituent-level, lemmatized files (for BERT)."""
 import argparse
-import os
-import re
-from collections import defaultdict
-from smart_open import open
-
-import sys
-sys.path.append('../')
-from utils.load_targets import load_targets
+from prep_data_bert import COLS_EXT, extract, get_const_targets
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('in_dir', help='one-sentence-per-line corpus')
     parser.add_argument('out_dir', help='where to write target-level files')
+    parser.add_argument('--columnar', help=f'read columnar corpora ({COLS_EXT}) '
+                        'from in_dir instead of .txt.gz files',
+                        action='store_true')
+    parser.add_argument('--max_open', help='maximum number of simultaneously '
+                        'open output files, default 256', default=256, type=int)
+    parser.add_argument('--max_per_target', '--max-per-target',
+                        help='keep a random sample of at most N sentences per '
+                        'target and decade', metavar='N', type=int)
+    parser.add_argument('--seed', help='seed for sampling, default 0',
+                        default=0, type=int)
+    parser.add_argument('--jobs', help='number of worker processes, default 1',
+                        default=1, type=int)
     args = parser.parse_args()
 
-    in_dir = args.in_dir
-    out_dir = args.out_dir
-
-    targets = set(load_targets())
-    targets = [w for cpd in targets for w in cpd.split('_')]
-    targets = set(targets)
-
-    in_files = os.listdir(in_dir)
-    in_files = [f for f in in_files if f.endswith('.txt.gz')]
-    in_files = sorted(in_files)
-
-    for in_file in in_files:
-
-        year = re.search('\d+', in_file).group()
-        target2line = defaultdict(list)
-
-        with open(os.path.join(in_dir, in_file), 'r') as f:
-            lines = f.readlines()
-
-        for line in lines:
-            line = [t.split('::')[0] for t in line.split()]
-            for target in set(line) & targets:
-                target2line[target].append(line)
-
-        write_out_dir = os.path.join(out_dir, year)
-        if os.path.isdir(write_out_dir):
-            raise ValueError('Output directory already exists.')
-
-        os.mkdir(write_out_dir)
-
-        for target in target2line:
-            out_lines = []
-            for line in target2line[target]:
-                out_line = []
-                out_line = ' '.join(out_line) + '\n'
-                out_lines.append(out_line)
-
-            out_file = os.path.join(write_out_dir, target + '.txt.gz')
-            with open(out_file, 'w') as f:
-                f.writelines(out_lines)
+    extract(args.in_dir, [(get_const_targets(), args.out_dir)],
+            columnar=args.columnar, max_open=args.max_open,
+            max_per_target=args.max_per_target, seed=args.seed,
+            jobs=args.jobs)
 
 if __name__ == '__main__':
     main()
@@ -1,13 +1,21 @@
 import argparse
+import gzip
+import io
+import json
 import logging
+import multiprocessing
 import os
 import pandas as pd
 import re
 import zipfile
-from nltk.util import ngrams
 
 from smart_open import open
-from reduce_pos import reduce_tag
+from reduce_pos import reduce_tags
+
+import sys
+sys.path.append('../')
+from utils.columnar_corpus import COLS_EXT, ColumnarCorpusWriter
+from utils.corpus_stats import STATS_EXT, CorpusStats
 
 
 def get_targets(targets_file):
@@ -27,6 +35,90 @@ def get_targets(targets_file):
     return targets
 
 
+# POS tags (reduced, lowercased) whose tokens are dropped from the output
+TAG_EXCL = {'y',    # regular punctuation
+            'q!',   # end-of-file tokens
+            '"',    # quotation marks
+            'z',    # -- symbol
+            '...',  # sequences of periods
+            'null', # varied minor stuff
+            '!',    # exclamation point
+            '-',    # dash
+            }
+
+
+class CompoundMatcher:
+    """Precompiled matcher for target compounds in lemmatized sentences.
+    
+    The lookup tables are built once from the target list, so that the cost
+    of processing a sentence does not depend on the number of targets.
+    
+    Args:
+        targets: Iterable of (modifier, head) tuples to join together.
+    """
+    
+    def __init__(self, targets):
+        self.targets = set(targets)
+        
+        # modifier -> set of heads, for space-separated (bigram) matches
+        self.heads = {}
+        for target in self.targets:
+            if len(target) == 2:
+                self.heads.setdefault(target[0], set()).add(target[1])
+        
+        # hyphenated and concatenated single-token versions
+        self.joint_targets = {'-'.join(t) for t in self.targets} |\
+                             {''.join(t) for t in self.targets}
+    
+    def __len__(self):
+        return len(self.targets)
+    
+    def process(self, lemmas, tags, keep_pos=False):
+        """Joins target compounds and filters a sentence in a single pass.
+        
+        Args:
+            lemmas: List of lemmas from target sentence.
+            tags: Corresponding list of POS tags from target sentence.
+            keep_pos: If true, appends POS tag to lemma in output.
+            
+        Returns:
+            A list of output lemmas, optionally with POS tags.
+        """
+        
+        heads = self.heads
+        joint_targets = self.joint_targets
+        no_heads = ()
+        
+        out = []
+        out_tag = ''
+        skip = False
+        last = len(lemmas) - 1
+        
+        for i, lemma in enumerate(lemmas):
+            tag = tags[i]
+            if i < last and lemmas[i+1] in heads.get(lemma, no_heads):
+                if tag == tags[i+1] == 'nn':
+                    if keep_pos:
+                        out_tag = f'::{tag}'
+                    out.append(f'{lemma}_{lemmas[i+1]}' + out_tag)
+                    skip = True
+            else:
+                if (not skip
+                    and tag not in TAG_EXCL
+                    and lemma != '<nul>'):
+                    if (tag == 'nn'
+                        and lemma in joint_targets):
+                        out_lemma = lemma.replace('-', '_')
+                    else:
+                        out_lemma = lemma
+                    if keep_pos:
+                        out_tag = f'::{tag}'
+                    out.append(out_lemma + out_tag)
+                skip = False
+        
+        return out
+
+
 def process_sent(tokens, lemmas, tags, targets, keep_pos=False):
     """Processes a sentence read from CoNLL-like CCOHA format. 
     
@@ -34,7 +126,8 @@ def process_sent(tokens, lemmas, tags, targets, keep_pos=False):
         tokens: List of tokens from target sentence.
         lemmas: Corresponding list of lemmas from target sentence.
         tags: Corresponding list of POS tags from target sentence.
-        targets: Iterable of (modifier, head) tuples to join together.
+        targets: CompoundMatcher, or iterable of (modifier, head) tuples to
+            join together (compiled on every call; prefer a CompoundMatcher).
         keep_pos: If true, appends POS tag to lemma in output.
         
     Returns:
@@ -42,87 +135,259 @@ def process_sent(tokens, lemmas, tags, targets, keep_pos=False):
         <nul> tokens.
     """
     
-    out = []
-    out_tag = ''
-    skip = False
-    
-    tag_excl = {'y',    # regular punctuation
-                'q!',   # end-of-file tokens
-                '"',    # quotation marks
-                'z',    # -- symbol
-                '...',  # sequences of periods
-                'null', # varied minor stuff
-                '!',    # exclamation point
-                '-',    # dash
-                }
-    
-    joint_targets = {'-'.join(t) for t in targets} |\
-                    {''.join(t) for t in targets}
-    
-    for i, ngram in enumerate(ngrams(lemmas, 2, pad_right=True)):
-        if ngram in targets:
-            if tags[i] == tags[i+1] == 'nn':
-                out_lemma = f'{lemmas[i]}_{lemmas[i+1]}'            
-                if keep_pos:
-                    #out_tag = f'::{tags[i]}_{tags[i+1]}'
-                    out_tag = f'::{tags[i]}'
-                out.append(out_lemma + out_tag)
-                skip = True
-        else:
-            if (not skip
-                and tags[i] not in tag_excl
-                and lemmas[i] != '<nul>'):
-                if (lemmas[i] in joint_targets 
-                    and tags[i] == 'nn'):
-                    out_lemma = lemmas[i].replace('-', '_')
-                else:
-                    out_lemma = lemmas[i]
-                if keep_pos:
-                    out_tag = f'::{tags[i]}'
-                out.append(out_lemma + out_tag)
-            skip = False
-            
-    return(' '.join(out))
+    if not isinstance(targets, CompoundMatcher):
+        targets = CompoundMatcher(targets)
+    
+    return ' '.join(targets.process(lemmas, tags, keep_pos=keep_pos))
 
 
-def process_file(lines, targets, keep_pos=False):
-    """Processes an individual CCOHA file.
+def iter_process_file(lines, targets, keep_pos=False):
+    """Lazily processes an individual CCOHA file.
     
     Args:
-        lines: List of lines in the file.
-        targets: Iterable of (modifier, head) tuples to join together.
+        lines: Iterable of lines in the file (e.g. an open file handle).
+        targets: CompoundMatcher, or iterable of (modifier, head) tuples.
         keep_pos: If true, appends POS tag to lemma in output.
         
-    Returns:
-        A list of processed lines, which contain whitespace-separated lemmas,
-        optionally with POS tags, and without punctuation or <nul> lemmas.
+    Yields:
+        Processed lines, one per sentence, as returned by `process_sent`.
     """
     
+    if not isinstance(targets, CompoundMatcher):
+        targets = CompoundMatcher(targets)
+    
     tokens = []
     lemmas = []
-    tags = []
-    processed = []
+    raw_tags = []
     
-    for i, line in enumerate(lines):
+    for line in lines:
         if line.startswith('@@'):
             continue
         if line.startswith('<eos>'):
-            out = process_sent(tokens, lemmas, tags, targets, 
+            tags = reduce_tags(raw_tags, lower=True)
+            yield process_sent(tokens, lemmas, tags, targets,
                                keep_pos=keep_pos)
-            processed.append(out)
             tokens = []
             lemmas = []
-            tags = []
+            raw_tags = []
         else:
             line = line.rstrip().split('\t')
-            token = line[0]
-            lemma = line[1]
-            tag = reduce_tag(line[2]).lower()
-            tokens.append(token)
-            lemmas.append(lemma)
-            tags.append(tag)
-            
-    return processed
+            tokens.append(line[0])
+            lemmas.append(line[1])
+            raw_tags.append(line[2])
+
+
+def process_file(lines, targets, keep_pos=False):
+    """Processes an individual CCOHA file.
+    
+    Args:
+        lines: List of lines in the file.
+        targets: Iterable of (modifier, head) tuples to join together.
+        keep_pos: If true, appends POS tag to lemma in output.
+        
+    Returns:
+        A list of processed lines, which contain whitespace-separated lemmas,
+        optionally with POS tags, and without punctuation or <nul> lemmas.
+    """
+    
+    return list(iter_process_file(lines, targets, keep_pos=keep_pos))
+
+
+def iter_member_lines(zf, file, fix_path=None):
+    """Streams the lowercased lines of a single CCOHA file.
+    
+    Args:
+        zf: Open ZipFile containing the decade's files.
+        file: Name of the member to read from the zip file.
+        fix_path: Optional path to an alternative version of the member, which
+            is read instead of the zipped one.
+        
+    Yields:
+        Lowercased lines, one at a time, so that memory use does not depend
+        on the size of the member.
+    """
+    
+    if fix_path is not None:
+        with open(fix_path, 'r') as f:
+            for line in f:
+                yield line.lower()
+    else:
+        with zf.open(file) as f:
+            for line in f:
+                yield line.decode('utf-8').lower()
+
+
+class CheckpointWriter:
+    """Appends compressed output in atomically committed chunks.
+    
+    Every commit writes the pending output as a complete gzip member and then
+    records the committed zip members, together with the new size of the
+    output file, in a JSON-lines manifest. On reopening, anything written
+    after the last recorded commit is truncated away, so that processing can
+    resume from the first uncommitted member.
+    
+    If `stats_dir` is set, the corpus statistics of each commit are stored
+    there as well, and those of all committed members are loaded into `stats`.
+    
+    Args:
+        out_file: Path to the .txt.gz output file.
+        manifest_file: Path to the manifest of committed members.
+        stats_dir: Optional directory for per-commit corpus statistics.
+    """
+    
+    def __init__(self, out_file, manifest_file, stats_dir=None):
+        self.manifest_file = manifest_file
+        self.stats_dir = stats_dir
+        self.committed = {}
+        self.stats = CorpusStats()
+        self.n_commits = 0
+        size = 0
+        
+        if os.path.isfile(manifest_file):
+            with io.open(manifest_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    for file, fix_file in entry['members']:
+                        self.committed[file] = fix_file
+                    size = entry['size']
+                    self.n_commits += 1
+                    if stats_dir is None:
+                        continue
+                    if 'stats' not in entry:
+                        raise ValueError('Committed output has no statistics; '
+                                         'the output must be rebuilt from '
+                                         'scratch.')
+                    self.stats.update(CorpusStats.load(
+                        os.path.join(stats_dir, entry['stats'])))
+        elif os.path.isfile(out_file):
+            raise ValueError('Output file already exists without a manifest '
+                             '(only runs started with --resume can be '
+                             'resumed).')
+        
+        if size and os.path.getsize(out_file) < size:
+            raise ValueError('Output file is shorter than its manifest.')
+        
+        self._raw = io.open(out_file, 'ab')
+        self._raw.truncate(size)
+        # Truncating leaves the position at the old end, which a commit
+        # without new output would otherwise record as the size
+        self._raw.seek(0, io.SEEK_END)
+        self._gz = None
+        self._pending = []
+        self._pending_stats = CorpusStats()
+        
+        if stats_dir is not None:
+            os.makedirs(stats_dir, exist_ok=True)
+    
+    def is_committed(self, file, fix_file=None):
+        """Checks whether a zip member was already committed.
+        
+        Raises:
+            ValueError: If the member was committed from a different source
+                (zip file or --fix_dir override) than the current one.
+        """
+        
+        if file not in self.committed:
+            return False
+        if self.committed[file] != fix_file:
+            raise ValueError(f'{file} was committed from a different source; '
+                             'the output must be rebuilt from scratch.')
+        
+        return True
+    
+    def write(self, text):
+        if self._gz is None:
+            self._gz = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        self._gz.write(text.encode('utf-8'))
+    
+    def add(self, file, fix_file=None, stats=None):
+        """Marks a member whose output (and stats) has been fully written."""
+        
+        self._pending.append([file, fix_file])
+        if stats is not None:
+            self._pending_stats.update(stats)
+    
+    def commit(self):
+        """Durably writes pending output, then records it in the manifest."""
+        
+        if not self._pending:
+            return
+        if self._gz is not None:
+            self._gz.close()
+            self._gz = None
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        
+        entry = {'members': self._pending, 'size': self._raw.tell()}
+        if self.stats_dir is not None:
+            entry['stats'] = f'{self.n_commits:06d}.json'
+            self._pending_stats.save(os.path.join(self.stats_dir,
+                                                  entry['stats']))
+        with io.open(self.manifest_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        
+        for file, fix_file in self._pending:
+            self.committed[file] = fix_file
+        self._pending = []
+        self._pending_stats = CorpusStats()
+        self.n_commits += 1
+    
+    def close(self):
+        self.commit()
+        self._raw.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        # Only commit output of a run that completed without errors
+        if exc[0] is None:
+            self.commit()
+        self._raw.close()
+
+
+# Per-process state for parallel processing, set up by `_init_worker`
+_worker_state = {}
+
+
+def _init_worker(in_file, targets, keep_pos, with_stats):
+    """Opens the decade's zip file once per worker process."""
+    
+    _worker_state['zf'] = zipfile.ZipFile(in_file, mode='r')
+    _worker_state['targets'] = targets
+    _worker_state['keep_pos'] = keep_pos
+    _worker_state['with_stats'] = with_stats
+
+
+def _process_member(member):
+    """Processes a (file, fix_path) member inside a worker process.
+    
+    Returns:
+        A string with all non-empty output lines for the member, in order,
+        and the member's CorpusStats (None if statistics are not collected).
+    """
+    
+    file, fix_path = member
+    lines = iter_member_lines(_worker_state['zf'], file, fix_path=fix_path)
+    out_lines = iter_process_file(lines, _worker_state['targets'],
+                                  keep_pos=_worker_state['keep_pos'])
+    out_text = ''.join(l + '\n' for l in out_lines if l)
+    
+    if _worker_state['with_stats']:
+        member_stats = CorpusStats()
+        member_stats.add_text(out_text)
+    else:
+        member_stats = None
+    
+    return out_text, member_stats
+
+
+def _fix_name(fix_path):
+    """Name under which a member's source is recorded in the manifest."""
+    
+    return None if fix_path is None else os.path.basename(fix_path)
 
 
 def main():
@@ -136,6 +401,19 @@ def main():
                         'versions, expecting format <decade>s_<filename>.txt')
     parser.add_argument('--pos', help='retain POS tags for targets/contexts',
                         action='store_true')
+    parser.add_argument('--jobs', help='number of worker processes, default 1',
+                        default=1, type=int)
+    parser.add_argument('--columnar', help='also write a memory-mappable, '
+                        f'integer-encoded version of the output ({COLS_EXT})',
+                        action='store_true')
+    parser.add_argument('--resume', help='record progress in a manifest, and '
+                        'skip files already committed to the output (as '
+                        'recorded in it) and append the remaining ones; the '
+                        'interrupted run must also have used --resume',
+                        action='store_true')
+    parser.add_argument('--stats', help='also write lemma, lemma::tag, '
+                        f'compound and constituent counts ({STATS_EXT})',
+                        action='store_true')
     
     args = parser.parse_args()
     targets_file = args.targets_file
@@ -143,18 +421,25 @@ def main():
     out_dir = args.out_dir
     fix_dir = args.fix_dir
     keep_pos = args.pos
+    jobs = args.jobs
+    columnar = args.columnar
+    resume = args.resume
+    with_stats = args.stats
+    
+    if columnar and resume:
+        parser.error('--columnar cannot be combined with --resume')
     
     logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
                         level=logging.INFO)
     
-    # Get set of (word1, word2) target tuples
-    targets = get_targets(targets_file)
+    # Compile matcher for set of (word1, word2) target tuples
+    targets = CompoundMatcher(get_targets(targets_file))
     logging.info(f'Loaded {len(targets)} compounds from: {targets_file}.')
     logging.info(f'Keeping POS tags for target/context lemmas: {keep_pos}.')
     
     # Set up alternative file versions (e.g. with fixed EOS tags)
     if fix_dir is not None:
-        fix_files = os.listdir(fix_dir)
+        fix_files = set(os.listdir(fix_dir))
         logging.info(f'Using alternative corpus files from: {fix_dir}.')
     else:
         fix_files = []
@@ -162,37 +447,102 @@ def main():
     # Set up output file
     out_file = os.path.splitext(os.path.basename(in_file))[0] + '.txt.gz'
     out_file = os.path.join(out_dir, out_file)
-    if os.path.isfile(out_file):
+    manifest_file = out_file + '.manifest'
+    if os.path.isfile(out_file) and not resume:
         raise ValueError('Output file already exists.')
+    if columnar:
+        cols_file = out_file[:-len('.txt.gz')] + COLS_EXT
+        cols_writer = ColumnarCorpusWriter(cols_file)
+        logging.info(f'Writing columnar output to {cols_file}.')
+    if with_stats:
+        stats_file = out_file[:-len('.txt.gz')] + STATS_EXT
+        stats = CorpusStats()
+        logging.info(f'Writing corpus statistics to {stats_file}.')
     
     # Process input file
     with zipfile.ZipFile(in_file, mode='r') as zf:
 
-        year = re.search('\d+', in_file).group()
+        year = re.search(r'\d+', in_file).group()
         file_list = zf.namelist()
         
         logging.info(f'Reading {len(file_list)} files from {in_file}.')
         logging.info(f'Writing output to {out_file}.')
         
-        for i, file in enumerate(file_list):
-            
+        # Pair each member with its alternative version, if there is one
+        members = []
+        for file in file_list:
             fix_file = f'{year}s_{file}'
             if fix_file in fix_files:
-                with open(os.path.join(fix_dir, fix_file), 'r') as f:
-                    lines = f.readlines()
-                    lines = [l.lower() for l in lines]
+                members.append((file, os.path.join(fix_dir, fix_file)))
                 logging.info(f'Reading from {fix_file}.')
             else:
-                with zf.open(file) as f:
-                    lines = f.readlines()
-                    lines = [l.decode('utf-8').lower() for l in lines]
-                    
-            out_lines = process_file(lines, targets, keep_pos=keep_pos)
-            with open(out_file, 'a') as of:
-                of.writelines([l+'\n' for l in out_lines if l])
+                members.append((file, None))
+        
+        if resume:
+            stats_dir = manifest_file + '.stats' if with_stats else None
+            of = CheckpointWriter(out_file, manifest_file,
+                                  stats_dir=stats_dir)
+            if with_stats:
+                stats.update(of.stats)
+            members = [(file, fix_path) for file, fix_path in members
+                       if not of.is_committed(file, _fix_name(fix_path))]
+            logging.info(f'Resuming: {len(file_list) - len(members)} files '
+                         f'already committed, {len(members)} remaining.')
+        else:
+            of = open(out_file, 'w')
+        
+        with of:
+            if jobs > 1:
+                # imap yields results in input order, so the output is
+                # identical to the serial run
+                logging.info(f'Processing with {jobs} worker processes.')
+                with multiprocessing.Pool(jobs, initializer=_init_worker,
+                        initargs=(in_file, targets, keep_pos,
+                                  with_stats)) as pool:
+                    results = pool.imap(_process_member, members,
+                                        chunksize=4)
+                    for i, (out_text, member_stats) in enumerate(results):
+                        of.write(out_text)
+                        if columnar:
+                            # Split on '\n' only, as the serial run writes
+                            # lines (splitlines would also split on \u2028 etc.)
+                            for out_line in out_text.split('\n')[:-1]:
+                                cols_writer.add_sentence(out_line.split())
+                        if with_stats:
+                            stats.update(member_stats)
+                        if resume:
+                            of.add(members[i][0], _fix_name(members[i][1]),
+                                   stats=member_stats)
+                        if (i+1) % 100 == 0:
+                            if resume:
+                                of.commit()
+                            logging.info(f'Processed {i+1} files.')
+            else:
+                for i, (file, fix_path) in enumerate(members):
+                    member_stats = CorpusStats() if with_stats else None
+                    lines = iter_member_lines(zf, file, fix_path=fix_path)
+                    for out_line in iter_process_file(lines, targets,
+                                                      keep_pos=keep_pos):
+                        if out_line:
+                            of.write(out_line + '\n')
+                            if columnar:
+                                cols_writer.add_sentence(out_line.split())
+                            if with_stats:
+                                member_stats.add_line(out_line)
                     
-            if (i+1) % 100 == 0:
-                logging.info(f'Processed {i+1} files.')
+                    if with_stats:
+                        stats.update(member_stats)
+                    if resume:
+                        of.add(file, _fix_name(fix_path), stats=member_stats)
+                    if (i+1) % 100 == 0:
+                        if resume:
+                            of.commit()
+                        logging.info(f'Processed {i+1} files.')
+    
+    if columnar:
+        cols_writer.close()
+    if with_stats:
+        stats.save(stats_file, targets=targets.targets)
     
     logging.info('Done.')
 
@@ -2,6 +2,7 @@
 # Link to tagset and descriptions: https://ucrel.lancs.ac.uk/claws7tags.html
 
 from argparse import ArgumentParser
+from itertools import islice
 import sys
 
 MAPPING = {
@@ -150,7 +151,7 @@ MAPPING = {
     "Q!": "Q!",
 }
 
-def reduce_tag(tag: str) -> str:
+def _reduce_tag(tag: str) -> str:
     single_tag = None
     # multiple possible tags are concatenated with "_"
 
@@ -183,12 +184,49 @@ def reduce_tag(tag: str) -> str:
     return MAPPING[single_tag.upper()]
 
 
+# raw tag -> reduced tag, and raw tag -> lowercased reduced tag;
+# CLAWS tag strings repeat heavily, so these stay small
+_REDUCED = {}
+_REDUCED_LOWER = {}
+
+
+def reduce_tag(tag: str) -> str:
+    # memoized version of _reduce_tag
+    try:
+        return _REDUCED[tag]
+    except KeyError:
+        reduced = _REDUCED[tag] = _reduce_tag(tag)
+        return reduced
+
+
+def reduce_tags(tags, lower=False) -> list:
+    # batch version of reduce_tag, e.g. for a whole sentence or file column;
+    # with lower=True, equivalent to [reduce_tag(t).lower() for t in tags]
+    cache = _REDUCED_LOWER if lower else _REDUCED
+    out = []
+    for tag in tags:
+        try:
+            reduced = cache[tag]
+        except KeyError:
+            reduced = reduce_tag(tag)
+            if lower:
+                reduced = reduced.lower()
+            cache[tag] = reduced
+        out.append(reduced)
+    return out
+
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("in_file")
+    parser.add_argument("--batch", type=int, default=10000,
+                        help="number of lines reduced at once")
     args = parser.parse_args()
     with open(args.in_file, encoding='utf-8') as in_f:
-        for line in in_f:
-            tok, lem, tag = line.split("\t")
-            print(f"{tok}\t{lem}\t{reduce_tag(tag).lower()}")
+        while True:
+            batch = [line.split("\t") for line in islice(in_f, args.batch)]
+            if not batch:
+                break
+            tags = reduce_tags([tag for _, _, tag in batch], lower=True)
+            sys.stdout.writelines(f"{tok}\t{lem}\t{tag}\n"
+                                  for (tok, lem, _), tag in zip(batch, tags))
@@ -0,0 +1,54 @@
+"""Bounded pool of per-target output files."""
+import os
+from collections import OrderedDict
+from smart_open import open
+
+
+class WriterPool:
+    """Keeps at most `max_open` per-target (compressed) files open at once.
+
+    When the limit is reached, the least recently used file is closed, and it
+    is reopened in append mode the next time its target is written to. For
+    .gz files, this adds a new gzip member, which decompresses to the same
+    content as a single-member file.
+
+    Args:
+        out_dir: Directory in which to write `<target><ext>` files.
+        max_open: Maximum number of simultaneously open files.
+        ext: File extension, which determines compression.
+    """
+
+    def __init__(self, out_dir, max_open=256, ext='.txt.gz'):
+        self.out_dir = out_dir
+        self.max_open = max_open
+        self.ext = ext
+        self._open = OrderedDict()
+        self._seen = set()
+
+    def write(self, target, text):
+        """Appends text to the target's file."""
+
+        f = self._open.get(target)
+        if f is None:
+            if len(self._open) >= self.max_open:
+                _, lru = self._open.popitem(last=False)
+                lru.close()
+            mode = 'a' if target in self._seen else 'w'
+            f = open(os.path.join(self.out_dir, target + self.ext), mode)
+            self._open[target] = f
+            self._seen.add(target)
+        else:
+            self._open.move_to_end(target)
+
+        f.write(text)
+
+    def close(self):
+        while self._open:
+            _, f = self._open.popitem(last=False)
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts import their neighbors as top-level modules
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'preprocessing'))
+sys.path.insert(0, os.path.join(ROOT, 'w2v'))
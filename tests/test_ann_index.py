@@ -0,0 +1,51 @@
+import numpy as np
+from gensim.models import KeyedVectors
+
+from w2v_ann_index import IVFIndex
+from w2v_batch_utils import get_batch_nns
+
+
+class Model:
+    def __init__(self, wv):
+        self.wv = wv
+
+
+def make_model(n_vocab=200, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    wv = KeyedVectors(dim, count=0)
+    wv.add_vectors([f'w{i}' for i in range(n_vocab)],
+                   rng.standard_normal((n_vocab, dim)).astype(np.float32))
+    return Model(wv)
+
+
+def test_search_returns_k_neighbors_beyond_probed_lists():
+    model = make_model()
+    index = IVFIndex.build(model, n_lists=20)
+    k = 50
+    n_probe = 2
+    assert k > n_probe * np.diff(index.offsets).max()
+
+    query_vecs = model.wv.vectors[:10]
+    exclude_rows = np.arange(10)
+    nns = index.search(query_vecs, model, k=k, n_probe=n_probe,
+                       exclude_rows=exclude_rows)
+
+    for row, query_nns in zip(exclude_rows, nns):
+        keys = [key for key, _ in query_nns]
+        assert len(keys) == k
+        assert len(set(keys)) == k
+        assert model.wv.index_to_key[row] not in keys
+
+
+def test_search_all_lists_is_exact():
+    model = make_model()
+    index = IVFIndex.build(model, n_lists=20)
+
+    query_vecs = model.wv.vectors[:10]
+    exclude_rows = np.arange(10)
+    approx = index.search(query_vecs, model, k=10, n_probe=20,
+                          exclude_rows=exclude_rows)
+    exact = get_batch_nns(query_vecs, model, k=10, exclude_rows=exclude_rows)
+
+    for approx_nns, exact_nns in zip(approx, exact):
+        assert [key for key, _ in approx_nns] == [key for key, _ in exact_nns]
@@ -0,0 +1,91 @@
+import numpy as np
+from gensim.models import KeyedVectors
+
+from orthogonal_procrustes import procrustes_rotation
+from w2v_batch_utils import (get_all_nns, get_diachronic_cosines,
+                             get_synchronic_cosines)
+from w2v_feature_utils import (get_nns_pooledvec, get_safe_cos, get_safe_mean,
+                               get_safe_nns, get_safe_vec)
+
+
+class Model:
+    def __init__(self, wv):
+        self.wv = wv
+
+
+def make_model(n_vocab=300, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    wv = KeyedVectors(dim, count=0)
+    wv.add_vectors([f'w{i}' for i in range(n_vocab)],
+                   rng.standard_normal((n_vocab, dim)).astype(np.float32))
+    return Model(wv)
+
+
+# Targets shared by compounds, and missing from the model
+CPD_TARGETS = ['w0', 'w1', 'w2', 'missing', 'w4']
+MODIF_TARGETS = ['w10', 'w11', 'w10', 'w12', 'missing']
+HEAD_TARGETS = ['w20', 'w21', 'w22', 'w20', 'w23']
+
+
+def test_synchronic_cosines_match_per_target_cosines():
+    model = make_model()
+
+    scores = get_synchronic_cosines(model, CPD_TARGETS, MODIF_TARGETS, HEAD_TARGETS)
+    for i, (cpd, modif, head) in enumerate(zip(CPD_TARGETS, MODIF_TARGETS,
+                                               HEAD_TARGETS)):
+        vec_c = get_safe_vec(cpd, model)
+        vec_m = get_safe_vec(modif, model)
+        vec_h = get_safe_vec(head, model)
+        cos_cm = get_safe_cos(vec_c, vec_m)
+        cos_ch = get_safe_cos(vec_c, vec_h)
+        expected = {'cpd-modif': cos_cm,
+                    'cpd-head': cos_ch,
+                    'cpd-const': get_safe_cos(vec_c, get_safe_mean([vec_m, vec_h])),
+                    'cpd-add': cos_cm + cos_ch,
+                    'cpd-mult': cos_cm * cos_ch,
+                    'cpd-comb': cos_cm + cos_ch + cos_cm * cos_ch,
+                    'modif-head': get_safe_cos(vec_m, vec_h)}
+        for measure, score in expected.items():
+            np.testing.assert_allclose(scores[measure][i], score, atol=1e-6)
+
+
+def test_diachronic_cosines_match_per_target_cosines():
+    model1, model2 = make_model(seed=0), make_model(seed=1)
+    ortho = procrustes_rotation(model1, model2)
+
+    scores = get_diachronic_cosines(model1, model2, CPD_TARGETS, MODIF_TARGETS,
+                                    HEAD_TARGETS, ortho=ortho)
+    for i, (cpd, modif, head) in enumerate(zip(CPD_TARGETS, MODIF_TARGETS,
+                                               HEAD_TARGETS)):
+        vecs1 = [get_safe_vec(t, model1) for t in (cpd, modif, head)]
+        vecs2 = [get_safe_vec(t, model2, ortho) for t in (cpd, modif, head)]
+        expected = {'cpd-time': get_safe_cos(vecs1[0], vecs2[0]),
+                    'modif-time': get_safe_cos(vecs1[1], vecs2[1]),
+                    'head-time': get_safe_cos(vecs1[2], vecs2[2]),
+                    'const-time': get_safe_cos(get_safe_mean(vecs1[1:]),
+                                               get_safe_mean(vecs2[1:]))}
+        for measure, score in expected.items():
+            np.testing.assert_allclose(scores[measure][i], score, atol=1e-6)
+
+
+def assert_same_nns(got, expected):
+    if expected is np.nan:
+        assert got is np.nan
+        return
+    assert [key for key, _ in got] == [key for key, _ in expected]
+    np.testing.assert_allclose([sim for _, sim in got],
+                               [sim for _, sim in expected], atol=1e-6)
+
+
+def test_all_nns_match_per_target_search():
+    model = make_model()
+    k = 10
+
+    nns = get_all_nns(model, CPD_TARGETS, MODIF_TARGETS, HEAD_TARGETS, k=k,
+                      max_memory=0)
+    for i, (cpd, modif, head) in enumerate(zip(CPD_TARGETS, MODIF_TARGETS,
+                                               HEAD_TARGETS)):
+        assert_same_nns(nns['cpd'][i], get_safe_nns(cpd, model, k))
+        assert_same_nns(nns['modif'][i], get_safe_nns(modif, model, k))
+        assert_same_nns(nns['head'][i], get_safe_nns(head, model, k))
+        assert_same_nns(nns['const'][i], get_nns_pooledvec([modif, head], model, k))
@@ -0,0 +1,43 @@
+from gensim.models.word2vec import LineSentence
+
+from utils.columnar_corpus import (MAX_SENTENCE_LENGTH, ColumnarCorpus,
+                                   ColumnarCorpusWriter)
+from utils.corpus_cache import write_plain
+
+SENTENCES = [
+    ['a::nn', 'b::vb', 'c'],
+    ['b::vb'] * (2 * MAX_SENTENCE_LENGTH + 5),
+    ['d::jj', 'a::nn'],
+]
+
+
+def write_corpora(tmp_path):
+    txt_path = str(tmp_path / 'corpus.txt')
+    with open(txt_path, 'w', encoding='utf-8') as f:
+        for tokens in SENTENCES:
+            f.write(' '.join(tokens) + '\n')
+
+    cols_path = str(tmp_path / 'corpus.cols')
+    with ColumnarCorpusWriter(cols_path) as writer:
+        for tokens in SENTENCES:
+            writer.add_sentence(tokens)
+
+    return txt_path, cols_path
+
+
+def test_iter_matches_line_sentence(tmp_path):
+    txt_path, cols_path = write_corpora(tmp_path)
+
+    text_sents = list(LineSentence(txt_path))
+    assert [len(s) for s in text_sents] == [3, MAX_SENTENCE_LENGTH,
+                                            MAX_SENTENCE_LENGTH, 5, 2]
+    assert list(ColumnarCorpus(cols_path)) == text_sents
+
+
+def test_write_plain_round_trip(tmp_path):
+    txt_path, cols_path = write_corpora(tmp_path)
+
+    out_file = str(tmp_path / 'plain.txt')
+    write_plain([cols_path], out_file)
+    with open(txt_path, 'rb') as f_txt, open(out_file, 'rb') as f_out:
+        assert f_out.read() == f_txt.read()
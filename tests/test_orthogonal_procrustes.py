@@ -0,0 +1,82 @@
+import copy
+import os
+
+import numpy as np
+from gensim.models import KeyedVectors
+
+from orthogonal_procrustes import (cached_procrustes_alignment,
+                                   procrustes_align, procrustes_alignment)
+
+
+class Model:
+    def __init__(self, wv):
+        self.wv = wv
+
+
+def make_model(keys, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    wv = KeyedVectors(dim, count=0)
+    wv.add_vectors(keys, rng.standard_normal((len(keys), dim)).astype(np.float32))
+    for i, key in enumerate(keys):
+        wv.set_vecattr(key, 'count', len(keys) - i)
+    return Model(wv)
+
+
+def make_models():
+    keys = [f'w{i}' for i in range(50)]
+    base = make_model(keys, seed=0)
+    # Another order and vocabulary for the second model
+    other = make_model(keys[40:] + keys[5:30] + ['x1', 'x2'], seed=1)
+    return base, other
+
+
+def assert_same_alignment(alignment, expected):
+    for got, exp in zip(alignment, expected):
+        if isinstance(exp, slice):
+            assert got == exp
+        else:
+            np.testing.assert_array_equal(got, exp)
+
+
+def test_alignment_matches_in_place_alignment():
+    base, other = make_models()
+    base_vecs = base.wv.vectors.copy()
+    other_vecs = other.wv.vectors.copy()
+
+    ortho, idx1, idx2 = procrustes_alignment(base, other)
+    # The models are left unchanged
+    np.testing.assert_array_equal(base.wv.vectors, base_vecs)
+    np.testing.assert_array_equal(other.wv.vectors, other_vecs)
+
+    in_base, in_other = copy.deepcopy(base), copy.deepcopy(other)
+    procrustes_align(in_base, in_other)
+    assert in_base.wv.index_to_key == [base.wv.index_to_key[i] for i in idx1]
+    assert in_other.wv.index_to_key == [other.wv.index_to_key[i] for i in idx2]
+    np.testing.assert_allclose(in_other.wv.vectors, other.wv.vectors[idx2].dot(ortho),
+                               rtol=1e-5, atol=1e-6)
+
+
+def test_cached_alignment_matches_uncached(tmp_path):
+    base, other = make_models()
+    cache_dir = str(tmp_path / 'cache')
+
+    for anchors in [{}, {'top_n': 10, 'exclude': ['w5']}]:
+        expected = procrustes_alignment(base, other, **anchors)
+        # First call computes and saves, second call reads the cache
+        assert_same_alignment(cached_procrustes_alignment(base, other, cache_dir,
+                                                          **anchors), expected)
+        assert_same_alignment(cached_procrustes_alignment(base, other, cache_dir,
+                                                          **anchors), expected)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_cached_alignment_of_identical_vocabularies(tmp_path):
+    keys = [f'w{i}' for i in range(20)]
+    base, other = make_model(keys, seed=0), make_model(keys, seed=1)
+    cache_dir = str(tmp_path / 'cache')
+
+    expected = procrustes_alignment(base, other)
+    assert isinstance(expected[1], slice)
+    cached_procrustes_alignment(base, other, cache_dir)
+    assert_same_alignment(cached_procrustes_alignment(base, other, cache_dir),
+                          expected)
@@ -0,0 +1,54 @@
+import gzip
+import os
+import random
+
+from prep_data_bert import extract
+
+TARGETS = {'apple', 'pear', 'apple_tree'}
+
+
+def write_corpus(in_dir):
+    rng = random.Random(0)
+    words = ['apple::nn', 'pear::nn', 'apple_tree::nn', 'eat::vb', 'the::at']
+    os.mkdir(in_dir)
+    for decade in ['1830s', '1840s']:
+        with gzip.open(os.path.join(in_dir, f'cleaned_{decade}.txt.gz'), 'wt',
+                       encoding='utf-8') as f:
+            # Distinct sentences, to find them in the full output
+            for i in range(300):
+                f.write(' '.join(rng.choices(words, k=4) + [f'w{i}::nn']) + '\n')
+
+
+def read_outputs(out_dir):
+    outputs = {}
+    for year in sorted(os.listdir(out_dir)):
+        for name in sorted(os.listdir(os.path.join(out_dir, year))):
+            with gzip.open(os.path.join(out_dir, year, name), 'rt',
+                           encoding='utf-8') as f:
+                outputs[year, name] = f.read().splitlines()
+    return outputs
+
+
+def run(tmp_path, name, **kwargs):
+    out_dir = str(tmp_path / name)
+    os.mkdir(out_dir)
+    extract(str(tmp_path / 'corpus'), [(TARGETS, out_dir)], **kwargs)
+    return read_outputs(out_dir)
+
+
+def test_sample_is_reproducible(tmp_path):
+    write_corpus(str(tmp_path / 'corpus'))
+
+    full = run(tmp_path, 'full')
+    sample = run(tmp_path, 'sample', max_per_target=10, seed=1)
+    assert sample.keys() == full.keys()
+    for key, lines in sample.items():
+        assert len(lines) == 10
+        # A subset of the sentences, in corpus order
+        positions = [full[key].index(line) for line in lines]
+        assert positions == sorted(positions)
+
+    assert run(tmp_path, 'rerun', max_per_target=10, seed=1) == sample
+    assert run(tmp_path, 'parallel', max_per_target=10, seed=1, jobs=2) == sample
+    assert run(tmp_path, 'other_seed', max_per_target=10, seed=2) != sample
+    assert run(tmp_path, 'large', max_per_target=1000, seed=1) == full
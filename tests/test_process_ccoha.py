@@ -0,0 +1,28 @@
+import gzip
+
+from process_ccoha import CheckpointWriter
+
+
+def test_resume_commits_empty_member_after_crash(tmp_path):
+    out_file = str(tmp_path / 'cleaned_1830s.txt.gz')
+    manifest_file = out_file + '.manifest'
+
+    writer = CheckpointWriter(out_file, manifest_file)
+    writer.write('a::nn b::nn\n')
+    writer.add('text_1830_1.txt')
+    writer.commit()
+
+    # Crash after writing output that was never committed
+    writer.write('c::nn d::nn\n' * 1000)
+    writer._gz.close()
+    writer._raw.close()
+
+    # Resume with a member that has no output
+    with CheckpointWriter(out_file, manifest_file) as writer:
+        writer.add('text_1830_2.txt')
+
+    with CheckpointWriter(out_file, manifest_file) as writer:
+        assert writer.is_committed('text_1830_1.txt')
+        assert writer.is_committed('text_1830_2.txt')
+    with gzip.open(out_file, 'rt', encoding='utf-8') as f:
+        assert f.read() == 'a::nn b::nn\n'
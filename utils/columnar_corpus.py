@@ -0,0 +1,298 @@
+"""Columnar, memory-mappable version of the one-sentence-per-line corpus.
+
+A corpus is stored as a directory (named `<corpus>.cols` by convention) with:
+    lemmas.i32   lemma id of every token (int32)
+    tags.i32     tag id of every token (int32)
+    offsets.i64  start of every sentence in the token arrays, plus the end (int64)
+    lemmas.txt   lemma vocabulary, one per line, in id order
+    tags.txt     tag vocabulary, one per line, in id order ('' if no tag)
+    meta.json    token and sentence counts
+
+Tokens of the text corpus (`<lemma>::<pos>` or `<lemma>`) are split once, when
+writing, so that readers never need to parse strings again.
+"""
+import json
+import os
+from array import array
+
+import numpy as np
+
+COLS_EXT = '.cols'
+
+# Sentences are split into chunks of at most this many tokens when iterated
+# for training, as by gensim's LineSentence (which cuts longer sentences off)
+MAX_SENTENCE_LENGTH = 10000
+
+
+def is_columnar(path):
+    """Checks whether a path is a columnar corpus directory."""
+
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def read_meta(path):
+    """Reads the token and sentence counts of a columnar corpus."""
+
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        return json.load(f)
+
+
+def _load_array(path, dtype, size, mmap_mode):
+
+    if size == 0:
+        return np.zeros(0, dtype=dtype)
+    if mmap_mode is None:
+        return np.fromfile(path, dtype=dtype, count=size)
+
+    return np.memmap(path, dtype=dtype, mode=mmap_mode, shape=(size,))
+
+
+class ColumnarCorpusWriter:
+    """Incrementally writes a columnar corpus.
+
+    Args:
+        path: Output directory, which must not exist yet.
+        buffer_size: Number of tokens buffered in memory before flushing.
+    """
+
+    def __init__(self, path, buffer_size=1000000):
+        if os.path.exists(path):
+            raise ValueError('Output corpus already exists.')
+        os.mkdir(path)
+
+        self.path = path
+        self.buffer_size = buffer_size
+        self.lemma2id = {}
+        self.tag2id = {}
+        self.n_tokens = 0
+        self.n_sents = 0
+
+        self._lemmas = array('i')
+        self._tags = array('i')
+        self._offsets = array('q', [0])
+        self._files = {name: open(os.path.join(path, name), 'wb')
+                       for name in ['lemmas.i32', 'tags.i32', 'offsets.i64']}
+
+    def add_sentence(self, tokens):
+        """Appends a sentence given as a list of `<lemma>::<pos>` tokens."""
+
+        lemma2id = self.lemma2id
+        tag2id = self.tag2id
+
+        for tok in tokens:
+            lemma, _, tag = tok.partition('::')
+            lemma_id = lemma2id.get(lemma)
+            if lemma_id is None:
+                lemma_id = lemma2id[lemma] = len(lemma2id)
+            tag_id = tag2id.get(tag)
+            if tag_id is None:
+                tag_id = tag2id[tag] = len(tag2id)
+            self._lemmas.append(lemma_id)
+            self._tags.append(tag_id)
+
+        self.n_tokens += len(tokens)
+        self.n_sents += 1
+        self._offsets.append(self.n_tokens)
+
+        if len(self._lemmas) >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+
+        for name, buffer in [('lemmas.i32', self._lemmas),
+                             ('tags.i32', self._tags),
+                             ('offsets.i64', self._offsets)]:
+            buffer.tofile(self._files[name])
+            del buffer[:]
+
+    def close(self):
+        """Flushes remaining tokens and writes vocabularies and metadata."""
+
+        self._flush()
+        for f in self._files.values():
+            f.close()
+
+        for name, vocab in [('lemmas.txt', self.lemma2id),
+                            ('tags.txt', self.tag2id)]:
+            with open(os.path.join(self.path, name), 'w',
+                      encoding='utf-8') as f:
+                f.writelines(w + '\n' for w in vocab)
+
+        # meta.json is written last, so that its presence marks completion
+        meta = {'n_tokens': self.n_tokens, 'n_sents': self.n_sents}
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ColumnarCorpus:
+    """Reads a columnar corpus, memory-mapping the token arrays.
+
+    Iterating over the corpus yields sentences as lists of `<lemma>::<pos>`
+    tokens, as in the text corpus, so it can be passed to gensim directly.
+
+    Args:
+        path: Corpus directory written by ColumnarCorpusWriter.
+        mmap_mode: Passed to np.memmap; None reads the arrays into memory.
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        if not is_columnar(path):
+            raise ValueError(f'Not a columnar corpus: {path}')
+
+        self.path = path
+        meta = read_meta(path)
+        self.n_tokens = meta['n_tokens']
+        self.n_sents = meta['n_sents']
+
+        self.lemmas = _load_array(os.path.join(path, 'lemmas.i32'),
+                                  np.int32, self.n_tokens, mmap_mode)
+        self.tags = _load_array(os.path.join(path, 'tags.i32'),
+                                np.int32, self.n_tokens, mmap_mode)
+        self.offsets = _load_array(os.path.join(path, 'offsets.i64'),
+                                   np.int64, self.n_sents + 1, mmap_mode)
+
+        with open(os.path.join(path, 'lemmas.txt'), 'r', encoding='utf-8') as f:
+            self.lemma_vocab = [w.rstrip('\n') for w in f]
+        with open(os.path.join(path, 'tags.txt'), 'r', encoding='utf-8') as f:
+            self.tag_vocab = [t.rstrip('\n') for t in f]
+
+        self._lemma_index = None
+
+    def __len__(self):
+        return self.n_sents
+
+    @property
+    def lemma_index(self):
+        """Dictionary from lemma to lemma id, built on first use."""
+
+        if self._lemma_index is None:
+            self._lemma_index = {w: i for i, w in enumerate(self.lemma_vocab)}
+
+        return self._lemma_index
+
+    def lemma_ids(self, lemmas):
+        """Maps lemmas to ids, leaving out those not in the corpus.
+
+        Returns:
+            A dictionary from lemma to lemma id.
+        """
+
+        index = self.lemma_index
+
+        return {w: index[w] for w in lemmas if w in index}
+
+    def sentence(self, i):
+        """Returns the (lemma ids, tag ids) arrays of sentence i."""
+
+        start, end = self.offsets[i], self.offsets[i+1]
+
+        return self.lemmas[start:end], self.tags[start:end]
+
+    def sentence_lemmas(self, i):
+        """Returns sentence i as a list of lemma strings."""
+
+        vocab = self.lemma_vocab
+
+        return [vocab[l] for l in self.sentence(i)[0].tolist()]
+
+    def iter_blocks(self, with_tags=True, block_size=10000,
+                    max_sentence_length=None):
+        """Iterates over sentences, decoding them block by block.
+
+        Args:
+            with_tags: If true, yields `<lemma>::<pos>` tokens, else lemmas.
+            block_size: Number of sentences decoded at once.
+            max_sentence_length: If set, sentences are split into chunks of
+                at most this many tokens (and empty sentences left out), as
+                by gensim's LineSentence.
+
+        Yields:
+            Sentences as lists of token strings.
+        """
+
+        vocab = self.lemma_vocab
+        suffixes = [f'::{t}' if t else '' for t in self.tag_vocab]
+
+        for first in range(0, self.n_sents, block_size):
+            offsets = self.offsets[first:first+block_size+1].tolist()
+            start, end = offsets[0], offsets[-1]
+            lemmas = self.lemmas[start:end].tolist()
+            if with_tags:
+                tokens = [vocab[l] + suffixes[t] for l, t
+                          in zip(lemmas, self.tags[start:end].tolist())]
+            else:
+                tokens = [vocab[l] for l in lemmas]
+            for s, e in zip(offsets[:-1], offsets[1:]):
+                if max_sentence_length is None:
+                    yield tokens[s-start:e-start]
+                    continue
+                for i in range(s, e, max_sentence_length):
+                    yield tokens[i-start:min(i+max_sentence_length, e)-start]
+
+    def __iter__(self):
+        return self.iter_blocks(with_tags=True,
+                                max_sentence_length=MAX_SENTENCE_LENGTH)
+
+    def find_sentences(self, lemma_ids, chunk_size=10000000, start=0,
+                       end=None):
+        """Finds the sentences containing any of the given lemmas.
+
+        Args:
+            lemma_ids: Iterable of lemma ids to look for.
+            chunk_size: Number of tokens scanned at once.
+            start: First sentence to search.
+            end: Sentence at which to stop searching (default: the end).
+
+        Returns:
+            A dictionary from lemma id to a sorted array of the (unique)
+            sentence indices in which it occurs.
+        """
+
+        lemma_ids = np.fromiter(lemma_ids, dtype=np.int32)
+        found_tokens = []
+        found_lemmas = []
+
+        end = self.n_sents if end is None else min(end, self.n_sents)
+        token_start = int(self.offsets[start]) if start < end else 0
+        token_end = int(self.offsets[end]) if start < end else 0
+
+        for first in range(token_start, token_end, chunk_size):
+            chunk = self.lemmas[first:min(first+chunk_size, token_end)]
+            positions = np.flatnonzero(np.isin(chunk, lemma_ids))
+            found_tokens.append(positions + first)
+            found_lemmas.append(chunk[positions])
+
+        if not found_tokens:
+            return {}
+
+        found_tokens = np.concatenate(found_tokens)
+        found_lemmas = np.concatenate(found_lemmas).astype(np.int64)
+        found_sents = np.searchsorted(self.offsets, found_tokens,
+                                      side='right') - 1
+
+        # Sort unique (lemma, sentence) pairs, then split by lemma
+        keys = np.unique(found_lemmas * self.n_sents + found_sents)
+        lemmas, sents = np.divmod(keys, self.n_sents)
+        bounds = np.flatnonzero(np.diff(lemmas)) + 1
+
+        return {int(group_lemmas[0]): group_sents for group_lemmas, group_sents
+                in zip(np.split(lemmas, bounds), np.split(sents, bounds))
+                if len(group_lemmas)}
+
+
+class ColumnarCorpora:
+    """Chains several columnar corpora (e.g. decades) into one iterable."""
+
+    def __init__(self, paths, mmap_mode='r'):
+        self.corpora = [ColumnarCorpus(p, mmap_mode=mmap_mode)
+                        for p in paths]
+
+    def __iter__(self):
+        for corpus in self.corpora:
+            yield from corpus
@@ -0,0 +1,151 @@
+"""Content-addressed caches of what word2vec training derives from a corpus.
+
+gensim reads a `corpus_file` with one reader per worker thread, but only from a
+plain one-sentence-per-line text file. Compressed (.txt.gz) and columnar
+corpora are therefore decompressed once into a cache directory, under the hash
+of their content, so the copy is reused by every model trained on the same data
+and rebuilt whenever the data changes.
+
+The word counts of the vocabulary scan are cached the same way (`.vocab.json`),
+so models that only differ in other hyperparameters skip the scan.
+"""
+import hashlib
+import json
+import logging
+import os
+
+from smart_open import open as smart_open
+
+from utils.columnar_corpus import ColumnarCorpus, is_columnar
+
+# Bump to invalidate existing cache files when their format changes
+CACHE_VERSION = 1
+
+BLOCK_SIZE = 1 << 20
+
+VOCAB_EXT = '.vocab.json'
+
+
+def _iter_files(path):
+    """Lists the files of a corpus (a columnar corpus is a directory)."""
+
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path))]
+
+    return [path]
+
+
+def hash_corpus(paths):
+    """Returns the hex digest of the content of corpus files, in order."""
+
+    h = hashlib.sha1(f'corpus_cache:{CACHE_VERSION}'.encode())
+    for path in paths:
+        h.update(b'\0corpus\0')
+        for file in _iter_files(path):
+            h.update(os.path.basename(file).encode() + b'\0')
+            with open(file, 'rb') as f:
+                while True:
+                    block = f.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    h.update(block)
+
+    return h.hexdigest()
+
+
+def write_plain(paths, out_file):
+    """Concatenates corpora into an uncompressed one-sentence-per-line file."""
+
+    with open(out_file, 'wb') as f_out:
+        for path in paths:
+            if is_columnar(path):
+                # Whole sentences, as in the text corpus
+                for tokens in ColumnarCorpus(path).iter_blocks():
+                    f_out.write((' '.join(tokens) + '\n').encode('utf-8'))
+                continue
+
+            last = b'\n'
+            with smart_open(path, 'rb') as f_in:
+                while True:
+                    block = f_in.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    f_out.write(block)
+                    last = block[-1:]
+            # Keeps the last sentence of a file apart from the next file
+            if last != b'\n':
+                f_out.write(b'\n')
+
+
+def _replace_atomic(write, out_file):
+    """Writes a file with `write(path)`, then renames it into place, so that
+    concurrent trainings building the same file never read a partial one."""
+
+    tmp_file = f'{out_file}.{os.getpid()}.tmp'
+    try:
+        write(tmp_file)
+        os.replace(tmp_file, out_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def get_corpus_file(paths, cache_dir, key=None):
+    """Returns the path to an uncompressed copy of corpora, creating it if
+    it is not cached yet.
+
+    Args:
+        paths: List of corpus files (.txt, .txt.gz or columnar corpora).
+        cache_dir: Directory with the cached copies.
+        key: Hash of the corpora, if already computed with `hash_corpus`.
+    """
+
+    key = key or hash_corpus(paths)
+    out_file = os.path.join(cache_dir, f'{key}.txt')
+    if os.path.isfile(out_file):
+        logging.info(f'Using cached corpus file: {out_file}')
+        return out_file
+
+    logging.info(f'Writing corpus file: {out_file}')
+    os.makedirs(cache_dir, exist_ok=True)
+    _replace_atomic(lambda path: write_plain(paths, path), out_file)
+
+    return out_file
+
+
+def load_vocab(key, cache_dir):
+    """Returns the cached vocabulary scan of corpora, or None.
+
+    Returns:
+        A dictionary with `counts` (word counts, in order of first
+        occurrence), `corpus_count` (number of sentences) and `total_words`.
+    """
+
+    vocab_file = os.path.join(cache_dir, key + VOCAB_EXT)
+    if not os.path.isfile(vocab_file):
+        return None
+
+    logging.info(f'Using cached vocabulary: {vocab_file}')
+    with open(vocab_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_vocab(key, cache_dir, counts, corpus_count, total_words):
+    """Caches the vocabulary scan of corpora (see `load_vocab`).
+
+    Counts are saved before any minimum frequency is applied, so they serve
+    models with any `min_count`.
+    """
+
+    vocab_file = os.path.join(cache_dir, key + VOCAB_EXT)
+    vocab = {'corpus_count': corpus_count,
+             'total_words': total_words,
+             'counts': counts}
+
+    def write(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(vocab, f, ensure_ascii=False)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    _replace_atomic(write, vocab_file)
+    logging.info(f'Cached vocabulary: {vocab_file}')
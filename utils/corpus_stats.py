@@ -0,0 +1,114 @@
+"""Frequency counts of the one-sentence-per-line corpus.
+
+Counts are collected while preprocessing and stored in a JSON sidecar next to
+each decade file (`<decade>.stats.json`), so that later stages can look up
+frequencies without rescanning the corpus.
+"""
+import json
+from collections import Counter
+
+STATS_EXT = '.stats.json'
+
+
+class CorpusStats:
+    """Sentence, token and per-token counts of (part of) a corpus.
+
+    Counts are kept per corpus token (`<lemma>::<pos>`, or `<lemma>` if no
+    tags were kept) and can be merged, so that counts of separately processed
+    files add up to those of the whole corpus. Merging in corpus order also
+    keeps tokens in order of first occurrence.
+
+    Args:
+        n_sents: Number of sentences.
+        n_tokens: Number of tokens.
+        token_counts: Mapping from token to count.
+    """
+
+    def __init__(self, n_sents=0, n_tokens=0, token_counts=None):
+        self.n_sents = n_sents
+        self.n_tokens = n_tokens
+        self.token_counts = Counter(token_counts or {})
+
+    def add_line(self, line):
+        """Counts one sentence of whitespace-separated tokens."""
+
+        tokens = line.split()
+        self.token_counts.update(tokens)
+        self.n_sents += 1
+        self.n_tokens += len(tokens)
+
+    def add_text(self, text):
+        """Counts newline-separated sentences.
+
+        Only newline characters separate sentences, as for files read line by
+        line (`str.splitlines` also splits on other line boundaries, such as
+        U+2028, which may occur inside a lemma).
+        """
+
+        lines = text.split('\n')
+        # A final newline ends the last sentence rather than starting one
+        if lines[-1] == '':
+            lines.pop()
+        for line in lines:
+            self.add_line(line)
+
+    def update(self, other):
+        """Adds the counts of another CorpusStats object."""
+
+        self.n_sents += other.n_sents
+        self.n_tokens += other.n_tokens
+        self.token_counts.update(other.token_counts)
+
+    def lemma_counts(self):
+        """Returns counts per lemma, summed over POS tags."""
+
+        counts = Counter()
+        for tok, n in self.token_counts.items():
+            counts[tok.partition('::')[0]] += n
+
+        return counts
+
+    def to_dict(self, targets=None):
+        """Converts counts to a JSON-serializable dictionary.
+
+        Args:
+            targets: Optional iterable of (modifier, head) tuples, for which
+                joined-compound and constituent counts are added.
+
+        Returns:
+            A dictionary with sentence and token totals, and counts per
+            `lemma_tag` token and per `lemma`.
+        """
+
+        lemma_counts = self.lemma_counts()
+        out = {'n_sents': self.n_sents,
+               'n_tokens': self.n_tokens,
+               'lemma_tag': dict(self.token_counts),
+               'lemma': dict(lemma_counts)}
+
+        if targets is not None:
+            targets = sorted(t for t in targets if len(t) == 2)
+            constituents = sorted({w for t in targets for w in t})
+            out['compounds'] = {f'{m}_{h}': lemma_counts.get(f'{m}_{h}', 0)
+                                for m, h in targets}
+            out['constituents'] = {w: lemma_counts.get(w, 0)
+                                   for w in constituents}
+
+        return out
+
+    def save(self, path, targets=None):
+        """Writes counts to a JSON file (see `to_dict`)."""
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(targets=targets), f)
+
+    @classmethod
+    def load(cls, path):
+        """Reads counts written by `save`."""
+
+        with open(path, 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+
+        return cls(n_sents=stats['n_sents'],
+                   n_tokens=stats['n_tokens'],
+                   token_counts=stats['lemma_tag'])
@@ -0,0 +1,183 @@
+"""Inverted index from lemmas to the sentences of a corpus file.
+
+An index is stored as a directory (named `<corpus>.idx` by convention) with:
+    vocab.txt   indexed lemmas, one per line
+    ptr.npy     start of every lemma's postings in sents.npy, plus the end
+    sents.npy   sorted, unique sentence (line) numbers per lemma
+    meta.json   name and number of sentences of the indexed corpus
+
+As every lemma is indexed, the contexts of a new target are found with a
+lookup rather than a rescan of the corpus.
+"""
+import json
+import os
+from array import array
+
+import numpy as np
+from smart_open import open as smart_open
+
+from utils.columnar_corpus import ColumnarCorpus, is_columnar
+
+INDEX_EXT = '.idx'
+
+
+class SentenceIndex:
+    """Maps lemmas to the numbers of the sentences in which they occur.
+
+    Args:
+        vocab: List of indexed lemmas.
+        ptr: Array of len(vocab) + 1 offsets into sents.
+        sents: Array of sentence numbers, sorted within each lemma.
+        meta: Dictionary with information about the indexed corpus.
+    """
+
+    def __init__(self, vocab, ptr, sents, meta=None):
+        self.vocab = vocab
+        self.ptr = ptr
+        self.sents = sents
+        self.meta = meta or {}
+        self.lemma_index = {w: i for i, w in enumerate(vocab)}
+
+    def __contains__(self, lemma):
+        return lemma in self.lemma_index
+
+    def lookup(self, lemma):
+        """Returns the sorted sentence numbers of a lemma (empty if unseen)."""
+
+        i = self.lemma_index.get(lemma)
+        if i is None:
+            return self.sents[:0]
+
+        return self.sents[self.ptr[i]:self.ptr[i+1]]
+
+    def count(self, lemma):
+        """Returns the number of sentences in which a lemma occurs."""
+
+        i = self.lemma_index.get(lemma)
+
+        return 0 if i is None else int(self.ptr[i+1] - self.ptr[i])
+
+    @classmethod
+    def from_columnar(cls, corpus):
+        """Builds the index of a ColumnarCorpus with vectorised operations."""
+
+        meta = {'corpus': os.path.basename(os.path.normpath(corpus.path)),
+                'n_sents': corpus.n_sents}
+        n_lemmas = len(corpus.lemma_vocab)
+        if corpus.n_tokens == 0:
+            return cls(corpus.lemma_vocab, np.zeros(n_lemmas + 1, np.int64),
+                       np.zeros(0, np.int64), meta)
+
+        sent_ids = np.repeat(np.arange(corpus.n_sents, dtype=np.int64),
+                             np.diff(corpus.offsets))
+        keys = np.unique(corpus.lemmas.astype(np.int64) * corpus.n_sents
+                         + sent_ids)
+        lemmas, sents = np.divmod(keys, corpus.n_sents)
+
+        ptr = np.zeros(n_lemmas + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum(np.bincount(lemmas, minlength=n_lemmas))
+
+        return cls(corpus.lemma_vocab, ptr, sents, meta)
+
+    @classmethod
+    def from_text(cls, path):
+        """Builds the index of a one-sentence-per-line (.txt.gz) corpus."""
+
+        postings = {}
+        n_sents = 0
+        with smart_open(path, 'r') as f:
+            for n, line in enumerate(f):
+                for lemma in {t.split('::')[0] for t in line.split()}:
+                    if lemma not in postings:
+                        postings[lemma] = array('q')
+                    postings[lemma].append(n)
+                n_sents = n + 1
+
+        vocab = list(postings)
+        lengths = np.fromiter((len(postings[w]) for w in vocab),
+                              dtype=np.int64, count=len(vocab))
+        ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum(lengths)
+        sents = np.empty(ptr[-1], dtype=np.int64)
+        for i, w in enumerate(vocab):
+            sents[ptr[i]:ptr[i+1]] = postings[w]
+
+        meta = {'corpus': os.path.basename(path), 'n_sents': n_sents}
+
+        return cls(vocab, ptr, sents, meta)
+
+    def save(self, path):
+        """Writes the index to a new directory."""
+
+        if os.path.exists(path):
+            raise ValueError('Output index already exists.')
+        os.mkdir(path)
+
+        with open(os.path.join(path, 'vocab.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(w + '\n' for w in self.vocab)
+        np.save(os.path.join(path, 'ptr.npy'), self.ptr)
+        np.save(os.path.join(path, 'sents.npy'), self.sents)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Reads an index, memory-mapping the postings by default."""
+
+        with open(os.path.join(path, 'vocab.txt'), 'r', encoding='utf-8') as f:
+            vocab = [w.rstrip('\n') for w in f]
+        ptr = np.load(os.path.join(path, 'ptr.npy'))
+        sents = np.load(os.path.join(path, 'sents.npy'), mmap_mode=mmap_mode)
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+
+        return cls(vocab, ptr, sents, meta)
+
+
+class ContextReader:
+    """Streams the sentences containing a target, using a SentenceIndex.
+
+    Columnar corpora are read with random access to the indexed sentences.
+    Compressed text corpora cannot be accessed randomly, so they are read
+    sequentially up to the last indexed sentence, skipping all others.
+
+    Args:
+        corpus_path: Path to the indexed .txt.gz file or columnar corpus.
+        index: SentenceIndex, or path to a saved one.
+    """
+
+    def __init__(self, corpus_path, index):
+        if not isinstance(index, SentenceIndex):
+            index = SentenceIndex.load(index)
+        self.index = index
+        self.corpus_path = corpus_path
+
+        if is_columnar(corpus_path):
+            self.corpus = ColumnarCorpus(corpus_path)
+            n_sents = index.meta.get('n_sents', self.corpus.n_sents)
+            if n_sents != self.corpus.n_sents:
+                raise ValueError('Index does not match the corpus.')
+        else:
+            self.corpus = None
+
+    def contexts(self, target):
+        """Yields the sentences containing a target as lists of lemmas."""
+
+        sents = self.index.lookup(target)
+        if self.corpus is not None:
+            for i in sents.tolist():
+                yield self.corpus.sentence_lemmas(i)
+            return
+
+        if len(sents) == 0:
+            return
+        wanted = iter(sents.tolist())
+        next_sent = next(wanted)
+        with smart_open(self.corpus_path, 'r') as f:
+            for n, line in enumerate(f):
+                if n < next_sent:
+                    continue
+                yield [t.split('::')[0] for t in line.split()]
+                next_sent = next(wanted, None)
+                if next_sent is None:
+                    break
@@ -1,41 +1,159 @@
 # Code from:
 # https://gist.github.com/zhicongchen/9e23d5c3f1e5b1293b16133485cd17d8#file-gensim_word2vec_procrustes_align-py
+import hashlib
+import logging
+import os
+
 import numpy as np
 
+from w2v_vector_store import hash_vectors
+
+def intersection_indices(m1, m2, words=None, exclude=None, top_n=None):
+    """
+    Find the shared vocabulary of two gensim word2vec models (or vector stores), without modifying them.
+    If 'words' is set (as list or set), then the vocabulary is intersected with this list as well.
+    If 'exclude' is set, these words are left out (e.g. the targets whose change is measured).
+    If 'top_n' is set, only the top_n most frequent shared words are kept (anchors).
+
+    Returns a pair (idx1, idx2) of row indices, such that m1.wv.vectors[idx1] and m2.wv.vectors[idx2] hold
+    the vectors of the same words, in the same order:
+        -- slices (giving views, no copy) if both models have the same vocabulary in the same order,
+           and no other restriction applies;
+        -- otherwise integer arrays, in order of descending frequency (=sum of counts from both m1 and m2),
+           ties in the order of m1.
+    """
+
+    keys1 = m1.wv.index_to_key
+    keys2 = m2.wv.index_to_key
+
+    # If no alignment necessary because vocab is identical...
+    if not words and not exclude and top_n is None and keys1 == keys2:
+        return slice(None), slice(None)
+
+    key_to_index2 = m2.wv.key_to_index
+    words = set(words) if words else None
+    exclude = set(exclude) if exclude else set()
+    common_vocab = [w for w in keys1 if w in key_to_index2 and (words is None or w in words)
+                    and w not in exclude]
+
+    idx1 = np.fromiter((m1.wv.key_to_index[w] for w in common_vocab), dtype=np.int64, count=len(common_vocab))
+    idx2 = np.fromiter((key_to_index2[w] for w in common_vocab), dtype=np.int64, count=len(common_vocab))
+
+    # Sort by frequency (summed for both)
+    counts = np.asarray(m1.wv.expandos['count'])[idx1] + np.asarray(m2.wv.expandos['count'])[idx2]
+    order = np.argsort(-counts, kind='stable')
+    if top_n is not None:
+        order = order[:top_n]
+
+    return idx1[order], idx2[order]
+
+def get_normed_rows(wv, idx):
+    """L2-normalized vectors of the rows `idx` (slice or index array) of a KeyedVectors."""
+
+    wv.fill_norms()
+
+    return wv.vectors[idx] / wv.norms[idx, np.newaxis]
+
+def procrustes_alignment(base_embed, other_embed, words=None, exclude=None, top_n=None):
+    """
+    Same as `procrustes_rotation`, also returning the shared-vocabulary (anchor) indices
+    (see `intersection_indices`), as a tuple (ortho, idx1, idx2).
+    """
+
+    idx1, idx2 = intersection_indices(base_embed, other_embed, words=words, exclude=exclude, top_n=top_n)
+    if not isinstance(idx1, slice) and len(idx1) == 0:
+        raise ValueError('No anchor words shared by the models.')
+
+    # get the (normalized) embedding matrices
+    base_vecs = get_normed_rows(base_embed.wv, idx1)
+    other_vecs = get_normed_rows(other_embed.wv, idx2)
+
+    # just a matrix dot product with numpy
+    m = other_vecs.T.dot(base_vecs)
+    # SVD method from numpy
+    u, _, v = np.linalg.svd(m)
+    # another matrix operation
+    ortho = u.dot(v)
+
+    return ortho, idx1, idx2
+
+def procrustes_rotation(base_embed, other_embed, words=None, exclude=None, top_n=None):
+    """
+    Orthogonal d x d matrix that best aligns other_embed to base_embed, leaving both models unchanged.
+    The alignment is fitted on the shared vocabulary, or only on anchor words (see `intersection_indices`):
+    the cross-covariance is computed over these rows only. The vector of any word of other_embed is then
+    aligned with `vec.dot(ortho)`, when (and if) it is needed.
+    """
+
+    return procrustes_alignment(base_embed, other_embed, words=words, exclude=exclude, top_n=top_n)[0]
+
+def get_alignment_path(base_embed, other_embed, cache_dir, words=None, exclude=None, top_n=None):
+    """
+    Cache file of the alignment of two models, named by the hashes of their content (see
+    w2v_vector_store.hash_vectors) and of the anchor selection.
+    """
+
+    if words or exclude or top_n is not None:
+        anchors = '\n'.join(['words'] + sorted(set(words or [])) +
+                             ['exclude'] + sorted(set(exclude or [])) +
+                             ['top_n', str(top_n)])
+        anchors = hashlib.sha1(anchors.encode('utf-8')).hexdigest()[:16]
+    else:
+        anchors = 'all'
+    name = f'{hash_vectors(base_embed.wv)}-{hash_vectors(other_embed.wv)}-{anchors}.npz'
+
+    return os.path.join(cache_dir, name)
+
+def cached_procrustes_alignment(base_embed, other_embed, cache_dir, words=None, exclude=None, top_n=None):
+    """
+    Same as `procrustes_alignment`, reading the alignment from (or saving it to) `cache_dir`, so that it is only
+    computed once for the same models and anchor words.
+    """
+
+    path = get_alignment_path(base_embed, other_embed, cache_dir, words=words, exclude=exclude, top_n=top_n)
+    if os.path.isfile(path):
+        with np.load(path) as cached:
+            if cached['identical']:
+                return cached['ortho'], slice(None), slice(None)
+            return cached['ortho'], cached['idx1'], cached['idx2']
+
+    ortho, idx1, idx2 = procrustes_alignment(base_embed, other_embed, words=words, exclude=exclude, top_n=top_n)
+
+    identical = isinstance(idx1, slice)
+    empty = np.zeros(0, dtype=np.int64)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Renamed into place once complete, for concurrent feature scripts
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, ortho=ortho, identical=identical,
+             idx1=empty if identical else idx1, idx2=empty if identical else idx2)
+    os.replace(tmp_path, path)
+    logging.info(f'Cached alignment: {path}')
+
+    return ortho, idx1, idx2
+
 def procrustes_align(base_embed, other_embed, words=None):
     """
     Original script: https://gist.github.com/quadrismegistus/09a93e219a6ffc4f216fb85235535faf
     Procrustes align two gensim word2vec models (to allow for comparison between same word across models).
     Code ported from HistWords <https://github.com/williamleif/histwords> by William Hamilton <wleif@stanford.edu>.
-        
+
     First, intersect the vocabularies (see `intersection_align_gensim` documentation).
     Then do the alignment on the other_embed model.
     Replace the other_embed model's syn0 and syn0norm numpy matrices with the aligned version.
     Return other_embed.
 
     If `words` is set, intersect the two models' vocabulary with the vocabulary in words (see `intersection_align_gensim` documentation).
-    """
 
-    # patch by Richard So [https://twitter.com/richardjeanso) (thanks!) to update this code for new version of gensim
-    # base_embed.init_sims(replace=True)
-    # other_embed.init_sims(replace=True)
+    Both models are modified in place; `procrustes_rotation` computes the same alignment without copies.
+    """
 
     # make sure vocabulary and indices are aligned
     in_base_embed, in_other_embed = intersection_align_gensim(base_embed, other_embed, words=words)
 
-    # get the (normalized) embedding matrices
-    base_vecs = in_base_embed.wv.get_normed_vectors()
-    other_vecs = in_other_embed.wv.get_normed_vectors()
-
-    # just a matrix dot product with numpy
-    m = other_vecs.T.dot(base_vecs) 
-    # SVD method from numpy
-    u, _, v = np.linalg.svd(m)
-    # another matrix operation
-    ortho = u.dot(v) 
+    ortho = procrustes_rotation(in_base_embed, in_other_embed)
     # Replace original array with modified one, i.e. multiplying the embedding matrix by "ortho"
-    other_embed.wv.vectors = (other_embed.wv.vectors).dot(ortho)    
-    
+    other_embed.wv.vectors = (other_embed.wv.vectors).dot(ortho)
+
     return other_embed
 
 def intersection_align_gensim(m1, m2, words=None):
@@ -48,43 +166,29 @@ def intersection_align_gensim(m1, m2, words=None):
         -- so that Row 0 of m1.syn0 will be for the same word as Row 0 of m2.syn0
         -- you can find the index of any word on the .index2word list: model.index2word.index(word) => 2
     The .vocab dictionary is also updated for each model, preserving the count but updating the index.
-    """
 
-    # Get the vocab for each model
-    vocab_m1 = set(m1.wv.index_to_key)
-    vocab_m2 = set(m2.wv.index_to_key)
+    Both models are modified in place; `intersection_indices` finds the same rows without modifying them.
+    """
 
-    # Find the common vocabulary
-    common_vocab = vocab_m1 & vocab_m2
-    if words: common_vocab &= set(words)
+    idx1, idx2 = intersection_indices(m1, m2, words=words)
 
     # If no alignment necessary because vocab is identical...
-    if not vocab_m1 - common_vocab and not vocab_m2 - common_vocab:
+    if isinstance(idx1, slice):
         return (m1,m2)
 
-    # Otherwise sort by frequency (summed for both)
-    common_vocab = list(common_vocab)
-    common_vocab.sort(key=lambda w: m1.wv.get_vecattr(w, "count") + m2.wv.get_vecattr(w, "count"), reverse=True)
-    # print(len(common_vocab))
+    common_vocab = [m1.wv.index_to_key[i] for i in idx1]
 
     # Then for each model...
-    for m in [m1, m2]:
+    for m, indices in [(m1, idx1), (m2, idx2)]:
         # Replace old syn0norm array with new one (with common vocab)
-        indices = [m.wv.key_to_index[w] for w in common_vocab]
-        old_arr = m.wv.vectors
-        new_arr = np.array([old_arr[index] for index in indices])
-        m.wv.vectors = new_arr
+        m.wv.vectors = m.wv.vectors[indices]
+        m.wv.norms = None
+        for attr in m.wv.expandos:
+            m.wv.expandos[attr] = m.wv.expandos[attr][indices]
 
         # Replace old vocab dictionary with new one (with common vocab)
         # and old index2word with new one
-        new_key_to_index = {}
-        new_index_to_key = []
-        for new_index, key in enumerate(common_vocab):
-            new_key_to_index[key] = new_index
-            new_index_to_key.append(key)
-        m.wv.key_to_index = new_key_to_index
-        m.wv.index_to_key = new_index_to_key
-        
-        #print(len(m.wv.key_to_index), len(m.wv.vectors))
-        
-    return (m1,m2)
\ No newline at end of file
+        m.wv.key_to_index = {key: new_index for new_index, key in enumerate(common_vocab)}
+        m.wv.index_to_key = list(common_vocab)
+
+    return (m1,m2)
@@ -0,0 +1,297 @@
+"""Approximate nearest-neighbor index (inverted file, IVF) for word2vec models.
+
+The normalized vectors of a model are clustered with spherical k-means into
+`n_lists` lists. A query is compared with the centroids first, and then only
+with the vectors of its `n_probe` closest lists, so that recall (and cost)
+grows with `n_probe`, up to exact search when all lists are probed.
+
+An index only holds the centroids and the list of every vocabulary row; it is
+saved next to the model (`<model name>.ivf<n_lists>.npz`) with the content
+hash of the vectors (see w2v_vector_store), and rebuilt when they change.
+
+Usage:
+    python w2v_ann_index.py <model_dir> --n_lists 64 --n_probe 1 2 4 8 -k 10
+builds the indices of the models in <model_dir> and reports recall@k against
+exact search, for the neighbors of the targets (run from the repository root,
+as the feature scripts).
+"""
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from w2v_batch_utils import (DEFAULT_MAX_MEMORY, get_all_nns, get_batch_unitvecs,
+                             get_normed_matrix)
+from w2v_vector_store import hash_vectors, load_vectors
+
+import sys
+sys.path.append('../')
+from utils.load_targets import load_targets
+
+INDEX_EXT = '.ivf{n_lists}.npz'
+
+DEFAULT_N_PROBE = 8
+
+
+def get_index_path(model_path, n_lists):
+    """Returns the index path of a saved model (`<name>.model`)."""
+
+    root, ext = os.path.splitext(model_path)
+
+    return (root if ext == '.model' else model_path) + INDEX_EXT.format(n_lists=n_lists)
+
+
+def get_default_n_lists(n_vocab):
+    """Number of lists for a vocabulary size (about 4 * sqrt(n_vocab))."""
+
+    return max(1, min(n_vocab, int(4 * np.sqrt(n_vocab))))
+
+
+def _assign(vecs, centroids, max_memory=DEFAULT_MAX_MEMORY):
+    """Closest centroid (by cosine) of every vector, in chunks of vectors."""
+
+    chunk_size = max(1, int(max_memory * 2**20 // (4 * len(centroids))))
+    labels = np.empty(len(vecs), dtype=np.int64)
+    for start in range(0, len(vecs), chunk_size):
+        labels[start:start+chunk_size] = \
+            np.asarray(vecs[start:start+chunk_size]).dot(centroids.T).argmax(axis=1)
+
+    return labels
+
+
+def train_centroids(normed, n_lists, n_iter=10, sample_size=256, seed=1):
+    """Clusters normalized vectors with spherical k-means.
+
+    Args:
+        normed: (n_vocab, dim) array of L2-normalized vectors.
+        n_lists: Number of clusters.
+        n_iter: Number of k-means iterations.
+        sample_size: Training vectors per cluster (a random sample of rows).
+        seed: Seed of the sample and initialization.
+
+    Returns:
+        A (n_lists, dim) array of L2-normalized centroids.
+    """
+
+    rng = np.random.default_rng(seed)
+    n_sample = min(len(normed), n_lists * sample_size)
+    sample = np.sort(rng.choice(len(normed), n_sample, replace=False))
+    train = np.asarray(normed[sample], dtype=np.float32)
+
+    centroids = train[rng.choice(n_sample, n_lists, replace=False)]
+    for _ in range(n_iter):
+        labels = _assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        norms = np.linalg.norm(sums, axis=1)
+
+        # Empty clusters restart from random training vectors
+        empty = norms == 0
+        sums[empty] = train[rng.choice(n_sample, empty.sum(), replace=False)]
+        norms[empty] = 1
+        centroids = sums / norms[:, np.newaxis]
+
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index over the vocabulary of a model.
+
+    Vocabulary rows are grouped by list: the rows of list `i` are
+    `rows[offsets[i]:offsets[i+1]]`.
+    """
+
+    def __init__(self, centroids, rows, offsets, content_hash=None):
+        self.centroids = centroids
+        self.rows = rows
+        self.offsets = offsets
+        self.content_hash = content_hash
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def get_n_probe(self, n_probe=None):
+        """Number of lists actually probed for `n_probe` (default if None)."""
+
+        return min(n_probe or DEFAULT_N_PROBE, self.n_lists)
+
+    @classmethod
+    def build(cls, model, n_lists=None, n_iter=10, sample_size=256, seed=1):
+        """Builds the index of a model (or vector store)."""
+
+        normed = get_normed_matrix(model)
+        n_lists = n_lists or get_default_n_lists(len(normed))
+        if not 0 < n_lists <= len(normed):
+            raise ValueError(f'Number of lists must be between 1 and {len(normed)}.')
+
+        centroids = train_centroids(normed, n_lists, n_iter=n_iter,
+                                    sample_size=sample_size, seed=seed)
+        labels = _assign(normed, centroids)
+        rows = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+
+        return cls(centroids, rows, offsets, hash_vectors(model.wv))
+
+    def save(self, path):
+        # Renamed into place once complete, for concurrent feature scripts
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, centroids=self.centroids, rows=self.rows,
+                 offsets=self.offsets, content_hash=self.content_hash)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as index:
+            return cls(index['centroids'], index['rows'], index['offsets'],
+                       str(index['content_hash']))
+
+    def search(self, query_vecs, model, k=10, n_probe=DEFAULT_N_PROBE,
+               exclude_rows=None):
+        """Finds approximate k nearest neighbors of query vectors.
+
+        Args:
+            query_vecs: (n, dim) array of query vectors, NaN rows for missing
+                queries.
+            model: Model (or vector store) the index was built for.
+            k: Number of neighbors.
+            n_probe: Number of lists searched per query (more lists give a
+                higher recall, all lists an exact search). Further lists are
+                searched if these hold fewer than k neighbors.
+            exclude_rows: Optional array with, for each query, a row of the
+                vocabulary to leave out, -1 for none.
+
+        Returns:
+            A list with, for each query, a list of (key, similarity) pairs in
+            decreasing order of similarity, or np.nan for missing queries (as
+            `w2v_batch_utils.get_batch_nns`).
+        """
+
+        normed = get_normed_matrix(model)
+        keys = model.wv.index_to_key
+        query_vecs = get_batch_unitvecs(query_vecs, normed.dtype)
+        found = ~np.isnan(query_vecs).any(axis=1)
+        if exclude_rows is None:
+            exclude_rows = np.full(len(query_vecs), -1, dtype=np.int64)
+        n_probe = self.get_n_probe(n_probe)
+
+        results = [np.nan] * len(query_vecs)
+        queries = np.flatnonzero(found)
+        if not len(queries):
+            return results
+
+        # Lists in order of closeness to each query
+        centroid_sims = query_vecs[queries].dot(self.centroids.T.astype(normed.dtype))
+        probes = np.argsort(-centroid_sims, axis=1, kind='stable')
+        list_sizes = np.diff(self.offsets)
+
+        for query, lists in zip(queries, probes):
+            # Probes further lists until they hold k neighbors besides the
+            # excluded row, so that every query gets k neighbors (as exact search)
+            n_rows = np.cumsum(list_sizes[lists])
+            n_lists = max(n_probe, np.searchsorted(n_rows, k + 1) + 1)
+            candidates = np.concatenate([self.rows[self.offsets[i]:self.offsets[i+1]]
+                                         for i in lists[:n_lists]])
+            candidates = candidates[candidates != exclude_rows[query]]
+            sims = normed[candidates].dot(query_vecs[query])
+
+            topn = min(k, len(candidates))
+            if topn < len(candidates):
+                best = np.argpartition(-sims, topn - 1)[:topn]
+            else:
+                best = np.arange(len(candidates))
+            best = best[np.argsort(-sims[best], kind='stable')]
+            results[query] = [(keys[j], float(sim)) for j, sim
+                              in zip(candidates[best].tolist(), sims[best].tolist())]
+
+        return results
+
+    def most_similar(self, key, model, topn=10, n_probe=DEFAULT_N_PROBE):
+        """Approximate `model.wv.most_similar(key, topn=topn)`."""
+
+        row = model.wv.get_index(key)
+        vec = model.wv.vectors[row][np.newaxis, :]
+
+        return self.search(vec, model, topn, n_probe, np.array([row]))[0]
+
+    def similar_by_vector(self, vec, model, topn=10, n_probe=DEFAULT_N_PROBE):
+        """Approximate `model.wv.similar_by_vector(vec, topn=topn)`."""
+
+        return self.search(np.asarray(vec)[np.newaxis, :], model, topn, n_probe)[0]
+
+
+def get_index(model, model_path, n_lists=None):
+    """Loads the index saved next to a model, building (and saving) it if it
+    does not exist yet or was built for other vectors."""
+
+    n_lists = n_lists or get_default_n_lists(len(model.wv))
+    path = get_index_path(model_path, n_lists)
+    if os.path.isfile(path):
+        index = IVFIndex.load(path)
+        if index.content_hash == hash_vectors(model.wv):
+            return index
+        logging.info(f'Rebuilding outdated index: {path}')
+
+    start = time.time()
+    index = IVFIndex.build(model, n_lists)
+    index.save(path)
+    logging.info(f'Built index with {n_lists} lists in {time.time() - start:.1f}s: {path}')
+
+    return index
+
+
+def get_recall(exact_nns, approx_nns):
+    """Mean recall@k of approximate neighbor lists (missing queries ignored)."""
+
+    recalls = [len({nn for nn, _ in approx} & {nn for nn, _ in exact}) / len(exact)
+               for exact, approx in zip(exact_nns, approx_nns)
+               if exact is not np.nan and len(exact)]
+
+    return np.mean(recalls) if recalls else np.nan
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_dir', help='directory with saved w2v models')
+    parser.add_argument('--n_lists', type=int, default=None,
+                        help='number of lists, default: 4 * sqrt(vocabulary size)')
+    parser.add_argument('--n_probe', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help='numbers of probed lists to report, default: 1 2 4 8 16')
+    parser.add_argument('-k', help='number of neighbors, default: 10',
+                         type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+
+    cpd_targets = load_targets(how='space')
+    modif_targets = [t.split()[0]+'::nn' for t in cpd_targets]
+    head_targets = [t.split()[1]+'::nn' for t in cpd_targets]
+    cpd_targets = [t.replace(' ', '_')+'::nn' for t in cpd_targets]
+
+    model_files = sorted(m for m in os.listdir(args.model_dir)
+                         if m.endswith('model'))
+    for model_file in model_files:
+        model_path = os.path.join(args.model_dir, model_file)
+        model = load_vectors(model_path)
+        index = get_index(model, model_path, args.n_lists)
+
+        start = time.time()
+        exact = get_all_nns(model, cpd_targets, modif_targets, head_targets, args.k)
+        exact_time = time.time() - start
+        logging.info(f'{model_file}: exact search in {exact_time:.2f}s')
+
+        for n_probe in args.n_probe:
+            start = time.time()
+            approx = get_all_nns(model, cpd_targets, modif_targets, head_targets,
+                                 args.k, index=index, n_probe=n_probe)
+            approx_time = time.time() - start
+            recall = get_recall(sum(exact.values(), []), sum(approx.values(), []))
+            logging.info(f'{model_file}: n_lists={index.n_lists} n_probe={n_probe} '
+                         f'recall@{args.k}={recall:.4f} in {approx_time:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
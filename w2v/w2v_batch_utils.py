@@ -0,0 +1,273 @@
+"""Batch versions of the cosine and neighbor features of w2v_feature_utils.
+
+Target keys are resolved to row indices once per model, missing targets are
+represented by NaN vectors, and every cosine is computed for all targets at
+once with whole-array operations. NaN propagates as with the per-target
+functions (a missing vector gives a NaN score), and scores are computed in
+float64, so they match the per-target (float32) scores up to rounding.
+
+Nearest neighbors of all targets are found with one exact search: the query
+vectors are stacked into a matrix, multiplied with the normalized vocabulary
+in chunks of queries, and the top k of each row selected with argpartition.
+"""
+import numpy as np
+
+from w2v_nns_cache import get_pooled_signature
+
+# Memory budget of a block of the neighbor search (similarities of queries x
+# vocabulary and the indices partitioned by argpartition), in MB
+DEFAULT_MAX_MEMORY = 256
+
+
+def get_rows(keys, model):
+    """Returns the row indices of keys in a model, -1 for missing keys."""
+
+    key_to_index = model.wv.key_to_index
+
+    return np.fromiter((key_to_index.get(key, -1) for key in keys),
+                       dtype=np.int64, count=len(keys))
+
+
+def get_batch_vecs(keys, model, ortho=None):
+    """Returns the vectors of keys as a (len(keys), dim) array, with NaN rows
+    for missing keys, optionally rotated (e.g. Procrustes-aligned) with
+    `ortho`."""
+
+    rows = get_rows(keys, model)
+    found = rows >= 0
+
+    vecs = np.full((len(keys), model.wv.vector_size), np.nan)
+    vecs[found] = model.wv.vectors[rows[found]]
+    if ortho is not None:
+        vecs = vecs.dot(ortho)
+
+    return vecs
+
+
+def get_batch_mean(vecs1, vecs2):
+    """Row-wise mean of two arrays of vectors (NaN if either is missing)."""
+
+    return (vecs1 + vecs2) / 2
+
+
+def get_batch_cos(vecs1, vecs2, distance=False):
+    """Row-wise cosine similarities (as scipy's `cosine`, clipped to [0, 2]
+    as a distance) of two arrays of vectors, NaN where either is missing."""
+
+    uv = np.einsum('ij,ij->i', vecs1, vecs2)
+    uu = np.einsum('ij,ij->i', vecs1, vecs1)
+    vv = np.einsum('ij,ij->i', vecs2, vecs2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cos = np.clip(1.0 - uv / np.sqrt(uu * vv), 0.0, 2.0)
+    if not distance:
+        cos = 1 - cos
+
+    return cos
+
+
+def get_synchronic_cosines(model, cpd_targets, modif_targets, head_targets):
+    """Computes the synchronic cosine features of all compounds in a model.
+
+    Returns:
+        A dictionary from measure to an array of scores, one per compound.
+    """
+
+    vec_c = get_batch_vecs(cpd_targets, model)
+    vec_m = get_batch_vecs(modif_targets, model)
+    vec_h = get_batch_vecs(head_targets, model)
+    vec_mh = get_batch_mean(vec_m, vec_h)
+
+    cos_mh = get_batch_cos(vec_m, vec_h)
+    cos_cm = get_batch_cos(vec_c, vec_m)
+    cos_ch = get_batch_cos(vec_c, vec_h)
+    cos_cmh = get_batch_cos(vec_c, vec_mh)
+    cos_add = cos_cm + cos_ch
+    cos_mult = cos_cm * cos_ch
+    cos_comb = cos_add + cos_mult
+
+    return {'cpd-modif': cos_cm,
+            'cpd-head': cos_ch,
+            'cpd-const': cos_cmh,
+            'cpd-add': cos_add,
+            'cpd-mult': cos_mult,
+            'cpd-comb': cos_comb,
+            'modif-head': cos_mh}
+
+
+def get_diachronic_cosines(model1, model2, cpd_targets, modif_targets,
+                           head_targets, ortho=None):
+    """Computes the diachronic cosine features of all compounds between two
+    models, rotating the vectors of model2 with `ortho` if set.
+
+    Returns:
+        A dictionary from measure to an array of scores, one per compound.
+    """
+
+    vecs = []
+    for model, model_ortho in [(model1, None), (model2, ortho)]:
+        vec_c = get_batch_vecs(cpd_targets, model, model_ortho)
+        vec_m = get_batch_vecs(modif_targets, model, model_ortho)
+        vec_h = get_batch_vecs(head_targets, model, model_ortho)
+        vecs.append((vec_c, vec_m, vec_h, get_batch_mean(vec_m, vec_h)))
+    (vec_c1, vec_m1, vec_h1, vec_mh1), (vec_c2, vec_m2, vec_h2, vec_mh2) = vecs
+
+    return {'cpd-time': get_batch_cos(vec_c1, vec_c2),
+            'modif-time': get_batch_cos(vec_m1, vec_m2),
+            'head-time': get_batch_cos(vec_h1, vec_h2),
+            'const-time': get_batch_cos(vec_mh1, vec_mh2)}
+
+
+def get_normed_matrix(model):
+    """Returns the L2-normalized vectors of a model (read from the vector
+    store if possible, see w2v_vector_store)."""
+
+    return model.wv.get_normed_vectors()
+
+
+def get_batch_unitvecs(vecs, dtype=None):
+    """Row-wise L2-normalized vectors (NaN rows stay NaN).
+
+    If `dtype` is set, the vectors are normalized in that precision, scaled by
+    the inverse of their norm as gensim's `matutils.unitvec` does (e.g. in
+    float32, as the queries of `most_similar`).
+    """
+
+    if dtype is not None:
+        vecs = np.asarray(vecs, dtype=dtype)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = 1.0 / np.linalg.norm(vecs, axis=1).astype(np.float64)
+        return vecs * scale.astype(vecs.dtype)[:, np.newaxis]
+
+
+def get_batch_nns(query_vecs, model, k=10, exclude_rows=None,
+                  max_memory=DEFAULT_MAX_MEMORY):
+    """Finds the exact k nearest neighbors (by cosine) of query vectors.
+
+    Args:
+        query_vecs: (n, dim) array of query vectors, NaN rows for missing
+            queries.
+        model: Model (or vector store) whose vocabulary is searched.
+        k: Number of neighbors.
+        exclude_rows: Optional array with, for each query, a row of the
+            vocabulary to leave out (the query's own key, as gensim's
+            `most_similar` does), -1 for none.
+        max_memory: Peak memory of a block of queries (its similarities to
+            the vocabulary and their int64 indices), in MB.
+
+    Returns:
+        A list with, for each query, a list of (key, similarity) pairs in
+        decreasing order of similarity, as `get_safe_nns` (up to float
+        rounding, which can swap neighbors whose similarities tie), or np.nan
+        for missing queries.
+    """
+
+    normed = get_normed_matrix(model)
+    keys = model.wv.index_to_key
+    n_vocab = len(keys)
+    query_vecs = get_batch_unitvecs(query_vecs, normed.dtype)
+    found = ~np.isnan(query_vecs).any(axis=1)
+    if exclude_rows is None:
+        exclude_rows = np.full(len(query_vecs), -1, dtype=np.int64)
+
+    # Queries per block, so that the similarities and argpartition's indices
+    # of a block fit the budget
+    bytes_per_sim = normed.dtype.itemsize + np.dtype(np.int64).itemsize
+    chunk_size = max(1, int(max_memory * 2**20 // (bytes_per_sim * max(n_vocab, 1))))
+    topn = min(k + 1, n_vocab)
+
+    results = [np.nan] * len(query_vecs)
+    queries = np.flatnonzero(found)
+    for start in range(0, len(queries), chunk_size):
+        chunk = queries[start:start+chunk_size]
+        sims = query_vecs[chunk].dot(normed.T)
+
+        excluded = exclude_rows[chunk]
+        has_excluded = excluded >= 0
+        sims[np.flatnonzero(has_excluded), excluded[has_excluded]] = -np.inf
+
+        if topn < n_vocab:
+            # Partitions the similarities themselves (no negated copy)
+            best = np.argpartition(sims, n_vocab - topn, axis=1)[:, -topn:]
+        else:
+            best = np.tile(np.arange(n_vocab), (len(chunk), 1))
+        best_sims = np.take_along_axis(sims, best, axis=1)
+        order = np.argsort(-best_sims, axis=1, kind='stable')
+        best = np.take_along_axis(best, order, axis=1)
+        best_sims = np.take_along_axis(best_sims, order, axis=1)
+
+        for i, query in enumerate(chunk):
+            nns = [(keys[j], float(sim))
+                   for j, sim in zip(best[i].tolist(), best_sims[i].tolist())
+                   if sim != -np.inf]
+            results[query] = nns[:k]
+
+    return results
+
+
+def get_all_nns(model, cpd_targets, modif_targets, head_targets, k=10,
+                max_memory=DEFAULT_MAX_MEMORY, index=None, n_probe=None,
+                cache=None):
+    """Finds the neighbors of all compounds, modifiers, heads, and pooled
+    modifier+head vectors in a model, with a single batched search.
+
+    Targets that occur several times (e.g. a head shared by compounds) are
+    searched once. If `index` is set (see w2v_ann_index), the search is
+    approximate, over the `n_probe` closest lists of the index for each
+    query. If `cache` is set (a w2v_nns_cache.NeighborCache), only the
+    queries it does not hold yet are searched, and their lists are added.
+
+    Returns:
+        A dictionary with, for 'cpd', 'modif', 'head' and 'const', a list of
+        neighbors per compound (see `get_batch_nns`), the same as
+        `get_safe_nns` and `get_nns_pooledvec` would return (up to float
+        rounding of ties).
+    """
+
+    n = len(cpd_targets)
+    pooled_targets = [get_pooled_signature([modif, head])
+                      for modif, head in zip(modif_targets, head_targets)]
+    queries = list(cpd_targets) + list(modif_targets) + list(head_targets) + pooled_targets
+
+    nns = {}
+    scope = None
+    if cache is not None:
+        scope = cache.get_scope(model, k, index=index, n_probe=n_probe)
+        for query in set(queries):
+            cached = cache.get(scope, query)
+            if cached is not None:
+                nns[query] = cached
+
+    # First occurrence of every query still to search
+    todo = list({query: i for i, query in reversed(list(enumerate(queries)))
+                 if query not in nns}.values())
+    if todo:
+        vecs = [get_batch_vecs(targets, model)
+                for targets in (cpd_targets, modif_targets, head_targets)]
+        rows = [get_rows(targets, model)
+                for targets in (cpd_targets, modif_targets, head_targets)]
+
+        # The pooled vectors are not keys, so nothing is excluded for them
+        query_vecs = np.vstack(vecs + [get_batch_mean(vecs[1], vecs[2])])[todo]
+        exclude_rows = np.concatenate(rows + [np.full(n, -1, dtype=np.int64)])[todo]
+
+        if index is None:
+            found = get_batch_nns(query_vecs, model, k=k, exclude_rows=exclude_rows,
+                                  max_memory=max_memory)
+        else:
+            found = index.search(query_vecs, model, k=k, n_probe=n_probe,
+                                 exclude_rows=exclude_rows)
+
+        for i, query_nns in zip(todo, found):
+            nns[queries[i]] = query_nns
+            if cache is not None and query_nns is not np.nan:
+                cache.put(scope, queries[i], query_nns)
+        if cache is not None:
+            cache.flush()
+
+    nns = [nns[query] for query in queries]
+
+    return {'cpd': nns[:n],
+            'modif': nns[n:2*n],
+            'head': nns[2*n:3*n],
+            'const': nns[3*n:]}
@@ -1,5 +1,4 @@
 import argparse
-import copy
 import csv
 import logging
 import numpy as np
@@ -9,10 +8,11 @@ import pandas as pd
 logging.getLogger('gensim').setLevel(logging.WARNING)
 
 from collections import defaultdict
-from gensim.models import Word2Vec
+from w2v_vector_store import load_vectors
 from scipy.spatial.distance import cosine
-from orthogonal_procrustes import procrustes_align
+from orthogonal_procrustes import cached_procrustes_alignment, procrustes_rotation
 from w2v_feature_utils import *
+from w2v_batch_utils import get_diachronic_cosines
 
 import sys
 sys.path.append('../')
@@ -46,7 +46,18 @@ def main():
     parser.add_argument('fine_dir', help='path to fine-grained w2v models')
     parser.add_argument('coarse_dir', help='path to coarse-grained w2v models')
     parser.add_argument('out_dir', help='output directory for features')
-
+    parser.add_argument('--no_align', help='skip Procrustes alignment, for '
+                        'models that already share a space (warm-started '
+                        'training, see w2v_train.py --init_model)',
+                        action='store_true')
+    parser.add_argument('--align_cache', help='directory where to cache '
+                        'alignments (by model content), default: always '
+                        'recompute alignments')
+    parser.add_argument('--anchors', help='align on the N most frequent shared '
+                        'words only, default: all shared words', metavar='N',
+                        type=int)
+    parser.add_argument('--exclude_targets', help='leave target compounds and '
+                        'constituents out of the alignment', action='store_true')
     args = parser.parse_args()  
     fine_dir = args.fine_dir
     coarse_dir = args.coarse_dir
@@ -64,6 +75,10 @@ def main():
     head_targets = [t.split()[1]+'::nn' for t in cpd_targets]
     cpd_targets = [t.replace(' ', '_')+'::nn' for t in cpd_targets]
 
+    # Words on which to fit the alignments
+    anchors = {'top_n': args.anchors}
+    if args.exclude_targets:
+        anchors['exclude'] = set(cpd_targets + modif_targets + head_targets)
     
     # Load models
     models = {}
@@ -76,7 +91,7 @@ def main():
 
         for model_file in model_files:
             year = model_file.split('_')[0]
-            models[grain][year] = Word2Vec.load(os.path.join(model_dir, model_file))
+            models[grain][year] = load_vectors(os.path.join(model_dir, model_file))
     
     logging.info('### Calculating diachronic cosines.')
     logging.info(f'Loaded models from {model_dir}.')
@@ -97,31 +112,24 @@ def main():
         
         for year1, year2 in year_pairs:
             
-            model1 = copy.deepcopy(models[grain][year1])
-            model2 = copy.deepcopy(models[grain][year2])
-            model2 = procrustes_align(model1, model2)
-
-            for cpd, modif, head in zip(cpd_targets, modif_targets, head_targets):
-
-                # Get vectors
-                vec_c = [get_safe_vec(cpd, model1), get_safe_vec(cpd, model2)]
-                vec_m = [get_safe_vec(modif, model1), get_safe_vec(modif, model2)]
-                vec_h = [get_safe_vec(head, model1), get_safe_vec(head, model2)]
-                vec_mh = [get_safe_mean([vec_m[0], vec_h[0]]),
-                          get_safe_mean([vec_m[1], vec_h[1]])]
-
-                # Compute cosines
-                cos_c = get_safe_cos(*vec_c)
-                cos_m = get_safe_cos(*vec_m)
-                cos_h = get_safe_cos(*vec_h)
-                cos_mh = get_safe_cos(*vec_mh)
-
-                # Store cosines
-                scores = {'cpd-time': cos_c,
-                          'modif-time': cos_m,
-                          'head-time': cos_h,
-                          'const-time': cos_mh,
-                         }
+            model1 = models[grain][year1]
+            model2 = models[grain][year2]
+            # Vectors of model2 are rotated into the space of model1
+            if args.no_align:
+                ortho = None
+            elif args.align_cache:
+                ortho, _, _ = cached_procrustes_alignment(model1, model2,
+                                                          args.align_cache,
+                                                          **anchors)
+            else:
+                ortho = procrustes_rotation(model1, model2, **anchors)
+
+            # All compounds at once
+            scores = get_diachronic_cosines(model1, model2, cpd_targets,
+                                            modif_targets, head_targets,
+                                            ortho=ortho)
+
+            for i, cpd in enumerate(cpd_targets):
 
                 cpd = cpd.replace('_', ' ')[:-4]
                 for score_type in scores:
@@ -129,7 +137,7 @@ def main():
                                  'grain': grain,
                                  'year': '_'.join([year1, year2]),
                                  'measure': score_type+run,
-                                 'score': scores[score_type]}
+                                 'score': scores[score_type][i]}
                     master_scores.append(out_score)
 
             logging.info(f'Processed {year1}-{year2}.')
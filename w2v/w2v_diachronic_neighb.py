@@ -9,9 +9,12 @@ import pandas as pd
 logging.getLogger('gensim').setLevel(logging.WARNING)
 
 from collections import defaultdict
-from gensim.models import Word2Vec
+from w2v_vector_store import load_vectors
 from scipy.spatial.distance import cosine
 from w2v_feature_utils import *
+from w2v_batch_utils import DEFAULT_MAX_MEMORY, get_all_nns
+from w2v_ann_index import DEFAULT_N_PROBE, get_index
+from w2v_nns_cache import NeighborCache
 
 import sys
 sys.path.append('../')
@@ -47,11 +50,27 @@ def main():
     parser.add_argument('out_dir', help='output directory for features')
     parser.add_argument('-k', help='number of neighbors, default: 10',
                          type=int, default=10)
+    parser.add_argument('--max_memory', type=int, default=DEFAULT_MAX_MEMORY,
+                        help='peak memory (in MB) of a block of queries in the '
+                             f'neighbor search, default: {DEFAULT_MAX_MEMORY}')
+    parser.add_argument('--ann_lists', type=int, default=None,
+                        help='search an approximate index with this number of lists '
+                             '(built next to each model if missing), default: exact search')
+    parser.add_argument('--ann_probe', type=int, default=DEFAULT_N_PROBE,
+                        help='number of lists searched per target with --ann_lists, '
+                             f'default: {DEFAULT_N_PROBE}')
+    parser.add_argument('--nns_cache', help='directory where to cache '
+                        'neighbor lists (by model content), default: keep '
+                        'them in memory only')
     args = parser.parse_args()  
     fine_dir = args.fine_dir
     coarse_dir = args.coarse_dir
     out_dir = args.out_dir
     k = args.k
+    max_memory = args.max_memory
+    ann_lists = args.ann_lists
+    ann_probe = args.ann_probe
+    nns_cache = NeighborCache(cache_dir=args.nns_cache)
     
     logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
                 level=logging.INFO)  
@@ -68,8 +87,10 @@ def main():
     
     # Load models
     models = {}
+    indices = {}
     for grain in model_dirs:
         models[grain] = {}
+        indices[grain] = {}
         model_dir = model_dirs[grain]
         model_files = os.listdir(model_dir)
         model_files = [m for m in model_files if m.endswith('model')]
@@ -77,7 +98,10 @@ def main():
 
         for model_file in model_files:
             year = model_file.split('_')[0]
-            models[grain][year] = Word2Vec.load(os.path.join(model_dir, model_file))
+            model_path = os.path.join(model_dir, model_file)
+            models[grain][year] = load_vectors(model_path)
+            if ann_lists:
+                indices[grain][year] = get_index(models[grain][year], model_path, ann_lists)
 
     logging.info('### Calculating diachronic neighbors.')        
     logging.info(f'Loaded models for k={k} from {model_dir}.')
@@ -96,21 +120,26 @@ def main():
         years = list(models[grain].keys())
         year_pairs = list(zip(years[:-1], years[1:]))
         
+        # Get neighbors of all targets at once, once per model
+        nns = {year: get_all_nns(models[grain][year], cpd_targets,
+                                 modif_targets, head_targets, k, max_memory,
+                                 index=indices[grain].get(year), n_probe=ann_probe,
+                                 cache=nns_cache)
+               for year in years}
+
         for year1, year2 in year_pairs:
             model1 = models[grain][year1]
             model2 = models[grain][year2]
+            nns1 = nns[year1]
+            nns2 = nns[year2]
         
-            for cpd, modif, head in zip(cpd_targets, modif_targets, head_targets):
+            for i, (cpd, modif, head) in enumerate(zip(cpd_targets, modif_targets, head_targets)):
 
                 # Get neighbors
-                nns_c = [get_safe_nns(cpd, model1, k), 
-                         get_safe_nns(cpd, model2, k)]
-                nns_m = [get_safe_nns(modif, model1, k), 
-                         get_safe_nns(modif, model2, k)]
-                nns_h = [get_safe_nns(head, model1, k), 
-                         get_safe_nns(head, model2, k)]
-                nns_mh = [get_nns_pooledvec([modif, head], model1, k),
-                          get_nns_pooledvec([modif, head], model2, k)]
+                nns_c = [nns1['cpd'][i], nns2['cpd'][i]]
+                nns_m = [nns1['modif'][i], nns2['modif'][i]]
+                nns_h = [nns1['head'][i], nns2['head'][i]]
+                nns_mh = [nns1['const'][i], nns2['const'][i]]
 
                 # Get overlap measure (Béné/Gonen)
                 overlap_c = get_nns_overlap(*nns_c)
@@ -1,12 +1,16 @@
 import numpy as np
 from scipy.spatial.distance import cosine
 
-def get_safe_vec(target, model):
+def get_safe_vec(target, model, ortho=None):
+    """Optionally rotates the vector (e.g. Procrustes-aligns it) with `ortho`."""
 
     try:
         vec = model.wv[target]
     except KeyError:
         vec = np.nan
+    else:
+        if ortho is not None:
+            vec = vec.dot(ortho)
         
     return vec
 
@@ -33,17 +37,22 @@ def get_safe_cos(vec1, vec2, distance=False):
     return cos
 
 
-def get_safe_nns(target, model, k=10):
+def get_safe_nns(target, model, k=10, index=None, n_probe=None):
+    """Optionally searches an approximate index (see w2v_ann_index)."""
     
     try:
-        nns = model.wv.most_similar(target, topn=k)
+        if index is None:
+            nns = model.wv.most_similar(target, topn=k)
+        else:
+            nns = index.most_similar(target, model, topn=k, n_probe=n_probe)
     except KeyError:
         nns = np.nan
         
     return nns
 
 
-def get_nns_pooledvec(targets, model, k=10):
+def get_nns_pooledvec(targets, model, k=10, index=None, n_probe=None):
+    """Optionally searches an approximate index (see w2v_ann_index)."""
     
     vecs = []
     for target in targets:
@@ -54,8 +63,10 @@ def get_nns_pooledvec(targets, model, k=10):
     
     if custom_vec is np.nan:
         nns = np.nan
-    else:
+    elif index is None:
         nns = model.wv.similar_by_vector(custom_vec, topn=k)
+    else:
+        nns = index.similar_by_vector(custom_vec, model, topn=k, n_probe=n_probe)
     
     return nns
 
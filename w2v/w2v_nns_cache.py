@@ -0,0 +1,121 @@
+"""Content-addressed cache of nearest-neighbor lists.
+
+Neighbor lists are keyed by the content hash of the model's vectors (see
+w2v_vector_store.hash_vectors), the search (exact, or the settings of an
+approximate index), k, and the query: a key, or the signature of a pooled
+vector (`get_pooled_signature`). They are kept in memory with LRU eviction (up
+to a total number of neighbors, so the memory used does not grow with k) and,
+if a cache directory is set, on disk as one JSON file per model, search and k:
+    <content hash>-<search>-k<k>.json
+so that other scripts, and reruns with other targets, reuse them.
+"""
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from w2v_vector_store import hash_vectors
+
+# Maximum number of neighbors (over all lists) kept in memory, i.e. a few
+# hundred MB of (key, similarity) pairs
+DEFAULT_MAX_NEIGHBORS = 1000000
+
+
+def get_pooled_signature(keys):
+    """Query signature of the mean vector of keys (e.g. modifier and head)."""
+
+    return 'mean:' + ' '.join(keys)
+
+
+def get_search_signature(index=None, n_probe=None):
+    """Name of a search: exact, or approximate with an index (see
+    w2v_ann_index) and number of probed lists."""
+
+    if index is None:
+        return 'exact'
+
+    return f'ivf{index.n_lists}-p{index.get_n_probe(n_probe)}'
+
+
+class NeighborCache:
+    """LRU cache of neighbor lists, optionally persisted in `cache_dir`.
+
+    Lists are looked up within a scope (model content, search and k, see
+    `get_scope`); new lists are written to disk by `flush`.
+    """
+
+    def __init__(self, max_neighbors=DEFAULT_MAX_NEIGHBORS, cache_dir=None):
+        self.max_neighbors = max_neighbors
+        self.cache_dir = cache_dir
+        self._lists = OrderedDict()
+        self._n_neighbors = 0
+        self._loaded = set()
+        self._pending = {}
+
+    def get_scope(self, model, k, index=None, n_probe=None):
+        """Returns the scope of a model and search, reading the lists saved
+        for it on disk (once) into memory."""
+
+        scope = (hash_vectors(model.wv), get_search_signature(index, n_probe), k)
+        if self.cache_dir and scope not in self._loaded:
+            self._loaded.add(scope)
+            path = self._get_path(scope)
+            if os.path.isfile(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                for query, nns in saved.items():
+                    self._store((scope, query), [tuple(nn) for nn in nns])
+                logging.info(f'Loaded {len(saved)} neighbor lists: {path}')
+
+        return scope
+
+    def get(self, scope, query):
+        """Returns the cached neighbor list of a query, or None."""
+
+        nns = self._lists.get((scope, query))
+        if nns is not None:
+            self._lists.move_to_end((scope, query))
+
+        return nns
+
+    def put(self, scope, query, nns):
+        """Caches the neighbor list of a query."""
+
+        self._store((scope, query), nns)
+        if self.cache_dir:
+            self._pending.setdefault(scope, {})[query] = nns
+
+    def flush(self):
+        """Writes the lists cached since the last flush to disk, merged with
+        the lists saved there (e.g. by other scripts)."""
+
+        for scope, lists in self._pending.items():
+            path = self._get_path(scope)
+            saved = {}
+            if os.path.isfile(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+            saved.update(lists)
+
+            # Renamed into place once complete, for concurrent feature scripts
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            logging.info(f'Cached {len(lists)} neighbor lists: {path}')
+        self._pending = {}
+
+    def _store(self, key, nns):
+        if key in self._lists:
+            self._n_neighbors -= len(self._lists.pop(key))
+        self._lists[key] = nns
+        self._n_neighbors += len(nns)
+        while self._n_neighbors > self.max_neighbors:
+            _, evicted = self._lists.popitem(last=False)
+            self._n_neighbors -= len(evicted)
+
+    def _get_path(self, scope):
+        content_hash, search, k = scope
+
+        return os.path.join(self.cache_dir, f'{content_hash}-{search}-k{k}.json')
@@ -9,9 +9,10 @@ import pandas as pd
 logging.getLogger('gensim').setLevel(logging.WARNING)
 
 from collections import defaultdict
-from gensim.models import Word2Vec
+from w2v_vector_store import load_vectors
 from scipy.spatial.distance import cosine
 from w2v_feature_utils import *
+from w2v_batch_utils import get_synchronic_cosines
 
 import sys
 sys.path.append('../')
@@ -84,33 +85,13 @@ def main():
         for model_file in model_files:
 
             year = model_file.split('_')[0]
-            model = Word2Vec.load(os.path.join(model_dir, model_file))
+            model = load_vectors(os.path.join(model_dir, model_file))
 
-            for cpd, modif, head in zip(cpd_targets, modif_targets, head_targets):
-                
-                # Get vectors
-                vec_c = get_safe_vec(cpd, model)
-                vec_m = get_safe_vec(modif, model)
-                vec_h = get_safe_vec(head, model)
-                vec_mh = get_safe_mean([vec_m, vec_h])
-
-                # Compute cosines
-                cos_mh = get_safe_cos(vec_m, vec_h)
-                cos_cm = get_safe_cos(vec_c, vec_m)
-                cos_ch = get_safe_cos(vec_c, vec_h)
-                cos_cmh = get_safe_cos(vec_c, vec_mh)
-                cos_add = cos_cm + cos_ch
-                cos_mult = cos_cm * cos_ch
-                cos_comb = cos_add + cos_mult
-
-                # Store cosines
-                scores = {'cpd-modif': cos_cm,
-                          'cpd-head': cos_ch,
-                          'cpd-const': cos_cmh,
-                          'cpd-add': cos_add,
-                          'cpd-mult': cos_mult,
-                          'cpd-comb': cos_comb,
-                          'modif-head': cos_mh}
+            # All compounds at once
+            scores = get_synchronic_cosines(model, cpd_targets, modif_targets,
+                                            head_targets)
+
+            for i, cpd in enumerate(cpd_targets):
 
                 cpd = cpd.replace('_', ' ')[:-4]
                 for score_type in scores:
@@ -118,7 +99,7 @@ def main():
                                  'grain': grain,
                                  'year': year,
                                  'measure': score_type+run,
-                                 'score': scores[score_type]}
+                                 'score': scores[score_type][i]}
                     master_scores.append(out_score)
 
             logging.info(f'Processed {year}.')
@@ -9,9 +9,12 @@ import pandas as pd
 logging.getLogger('gensim').setLevel(logging.WARNING)
 
 from collections import defaultdict
-from gensim.models import Word2Vec
+from w2v_vector_store import load_vectors
 from scipy.spatial.distance import cosine
 from w2v_feature_utils import *
+from w2v_batch_utils import DEFAULT_MAX_MEMORY, get_all_nns
+from w2v_ann_index import DEFAULT_N_PROBE, get_index
+from w2v_nns_cache import NeighborCache
 
 import sys
 sys.path.append('../')
@@ -47,11 +50,27 @@ def main():
     parser.add_argument('out_dir', help='output directory for features')
     parser.add_argument('-k', help='number of neighbors, default: 10',
                          type=int, default=10)
+    parser.add_argument('--max_memory', type=int, default=DEFAULT_MAX_MEMORY,
+                        help='peak memory (in MB) of a block of queries in the '
+                             f'neighbor search, default: {DEFAULT_MAX_MEMORY}')
+    parser.add_argument('--ann_lists', type=int, default=None,
+                        help='search an approximate index with this number of lists '
+                             '(built next to each model if missing), default: exact search')
+    parser.add_argument('--ann_probe', type=int, default=DEFAULT_N_PROBE,
+                        help='number of lists searched per target with --ann_lists, '
+                             f'default: {DEFAULT_N_PROBE}')
+    parser.add_argument('--nns_cache', help='directory where to cache '
+                        'neighbor lists (by model content), default: keep '
+                        'them in memory only')
     args = parser.parse_args()  
     fine_dir = args.fine_dir
     coarse_dir = args.coarse_dir
     out_dir = args.out_dir
     k = args.k
+    max_memory = args.max_memory
+    ann_lists = args.ann_lists
+    ann_probe = args.ann_probe
+    nns_cache = NeighborCache(cache_dir=args.nns_cache)
     
     logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
                 level=logging.INFO)  
@@ -86,15 +105,18 @@ def main():
         for model_file in model_files:
 
             year = model_file.split('_')[0]
-            model = Word2Vec.load(os.path.join(model_dir, model_file))
-
-            for cpd, modif, head in zip(cpd_targets, modif_targets, head_targets):
-
-                # Get neighbors
-                nns_c = get_safe_nns(cpd, model, k)
-                nns_m = get_safe_nns(modif, model, k)
-                nns_h = get_safe_nns(head, model, k)
-                nns_mh = get_nns_pooledvec([modif, head], model, k)
+            model_path = os.path.join(model_dir, model_file)
+            model = load_vectors(model_path)
+            index = get_index(model, model_path, ann_lists) if ann_lists else None
+
+            # Get neighbors of all targets at once
+            nns = get_all_nns(model, cpd_targets, modif_targets, head_targets,
+                              k, max_memory, index=index, n_probe=ann_probe,
+                              cache=nns_cache)
+            target_nns = zip(cpd_targets, modif_targets, head_targets,
+                             nns['cpd'], nns['modif'], nns['head'], nns['const'])
+
+            for cpd, modif, head, nns_c, nns_m, nns_h, nns_mh in target_nns:
 
                 # Get overlap measure (Béné/Gonen)
                 overlap_mh = get_nns_overlap(nns_m, nns_h)
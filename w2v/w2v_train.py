@@ -1,73 +1,455 @@
 import argparse
+import json
 import logging
 import os
 import re
+import resource
+import shutil
+import tempfile
+import time
+import numpy as np
 from gensim.models import word2vec
+from gensim.models.callbacks import CallbackAny2Vec
+from w2v_vector_store import export_store, get_store_path
 
+import sys
+sys.path.append('../')
+from utils.columnar_corpus import (COLS_EXT, ColumnarCorpus, ColumnarCorpora,
+                                   is_columnar)
+from utils.corpus_cache import (VOCAB_EXT, get_corpus_file, hash_corpus,
+                                load_vocab, save_vocab)
 
-def main():
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'w2v_corpus_cache')
+
+METRICS_EXT = '.metrics.json'
+
+
+class EpochTimer(CallbackAny2Vec):
+    """Records the wall time of every training epoch."""
     
-    parser = argparse.ArgumentParser()
-    parser.add_argument('corpus_path', help='directory or single corpus files')
-    parser.add_argument('model_path', help='directory where to save model')
-    parser.add_argument('--dims', help='vector dimensions, default 100',
-                        default=100, type=int)
-    parser.add_argument('--win', help='window around target, default 5',
-                        default=5, type=int)
-    parser.add_argument('--freq', help='minimum frequency, default 5',
-                        default=5, type=int)
-    parser.add_argument('--algo', help="one of ['cbow', 'sg'], default 'sg'",
-                        default='sg', choices=['cbow', 'sg'])
-    parser.add_argument('--work', help='number of workers, default 24',
-                        default=24, type=int)
-    args = parser.parse_args()
+    def __init__(self):
+        self.epoch_times = []
+        self._start = None
+    
+    def on_epoch_begin(self, model):
+        self._start = time.perf_counter()
+    
+    def on_epoch_end(self, model):
+        self.epoch_times.append(time.perf_counter() - self._start)
 
-    in_path = args.corpus_path
-    out_path = args.model_path
-    vector_size = args.dims
-    window = args.win
-    min_count = args.freq
-    algo = args.algo
-    sg = 1 if algo == 'sg' else 0
-    workers = args.work
 
-    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
-                        level=logging.INFO)
+def reset_peak_rss():
+    """Resets the peak resident set size of this process (Linux only), so
+    that `get_peak_rss` reports the peak of what follows, e.g. of one model
+    in a chain trained by the same process.
+    
+    Returns:
+        True if the peak was reset.
+    """
+    
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    
+    return True
+
+
+def get_peak_rss():
+    """Returns the peak resident set size of this process, in MB: since the
+    last `reset_peak_rss` (Linux), or since the process started."""
+    
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    # In kilobytes
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_corpus_bytes(paths):
+    """Returns the size on disk of corpus files (or columnar directories)."""
+    
+    size = 0
+    for path in paths:
+        if os.path.isdir(path):
+            size += sum(os.path.getsize(os.path.join(path, f))
+                        for f in os.listdir(path))
+        else:
+            size += os.path.getsize(path)
+    
+    return size
+
+
+class LineSentences:
+    """Iterates over a list of one-sentence-per-line files, in order."""
+    
+    def __init__(self, paths):
+        self.paths = paths
+    
+    def __iter__(self):
+        for path in self.paths:
+            yield from word2vec.LineSentence(path)
+
+
+def get_years(names):
+    """Returns the year span (e.g. '1830-1850') covered by corpus files."""
+    
+    years = [re.search(r'\d+', os.path.basename(os.path.normpath(f))).group()
+             for f in names]
+    years = sorted(years)
+    
+    return '-'.join([years[0], years[-1]])
+
+
+def get_corpus_years(in_path):
+    """Returns the years to use for the model name of a corpus.
+    
+    Args:
+        in_path: Single corpus file (text or columnar), directory of corpus
+            files, or list of corpus files.
+    """
+    
+    if isinstance(in_path, (list, tuple)):
+        return get_years(in_path)
+    if os.path.isdir(in_path) and not is_columnar(in_path):
+        in_files = sorted(os.listdir(in_path))
+        cols_files = [f for f in in_files if f.endswith(COLS_EXT)]
+        return get_years(cols_files or in_files)
     
-    # Set up input data + years to use for model name
-    if os.path.isdir(in_path):
-        sentences = word2vec.PathLineSentences(in_path)
-        years = [re.search('\d+', f).group() for f in os.listdir(in_path)]
-        years = sorted(years)
-        years = '-'.join([years[0], years[-1]])
+    years = os.path.basename(os.path.normpath(in_path))
+    
+    return re.search(r'\d+', years).group()
+
+
+def get_corpus_paths(in_path):
+    """Lists the corpus files read by `load_corpus`, in order."""
+    
+    if isinstance(in_path, (list, tuple)):
+        return list(in_path)
+    if os.path.isdir(in_path) and not is_columnar(in_path):
+        in_files = sorted(os.listdir(in_path))
+        cols_files = [f for f in in_files if f.endswith(COLS_EXT)]
+        return [os.path.join(in_path, f) for f in cols_files or in_files]
+    
+    return [in_path]
+
+
+def load_corpus(in_path):
+    """Sets up the training data and the years to use for the model name.
+    
+    Args:
+        in_path: Single corpus file (text or columnar), directory of corpus
+            files, or list of corpus files.
+        
+    Returns:
+        A (sentences, years) tuple.
+    """
+    
+    if isinstance(in_path, (list, tuple)):
+        if all(is_columnar(f) for f in in_path):
+            sentences = ColumnarCorpora(in_path)
+        else:
+            sentences = LineSentences(in_path)
+    elif is_columnar(in_path):
+        sentences = ColumnarCorpus(in_path)
+    elif os.path.isdir(in_path):
+        cols_files = sorted(f for f in os.listdir(in_path)
+                            if f.endswith(COLS_EXT))
+        if cols_files:
+            sentences = ColumnarCorpora([os.path.join(in_path, f)
+                                         for f in cols_files])
+        else:
+            sentences = word2vec.PathLineSentences(in_path)
     else:
         sentences = word2vec.LineSentence(in_path)
-        years = os.path.basename(os.path.normpath(in_path))
-        years = re.search('\d+', years).group()
+    
+    return sentences, get_corpus_years(in_path)
+
+
+def get_model_name(years, vector_size, window, min_count, algo):
+    
+    return f'{years}_d{vector_size}-w{window}-f{min_count}-{algo}.model'
+
+
+def get_vocab_key(key, corpus_file=False):
+    """Cache key of the vocabulary scan of a corpus with hash `key`.
+    
+    Scans of the iterable and of the `corpus_file` copy are cached apart, as
+    they can count sentences differently (e.g. for columnar corpora).
+    """
+    
+    return f"{key}-{'corpus_file' if corpus_file else 'iterable'}"
+
+
+def get_vocab(in_path, cache_dir=None, corpus_file=False, key=None):
+    """Returns the vocabulary scan of a corpus, from the cache if possible.
+    
+    Args:
+        in_path: Training data, as accepted by `load_corpus`.
+        cache_dir: Cache directory, default DEFAULT_CACHE_DIR.
+        corpus_file: If true, scans the uncompressed copy of the corpus.
+        key: Hash of the corpus, if already computed.
+        
+    Returns:
+        A dictionary as returned by utils.corpus_cache.load_vocab.
+    """
+    
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    paths = get_corpus_paths(in_path)
+    key = key or hash_corpus(paths)
+    vocab_key = get_vocab_key(key, corpus_file)
+    vocab = load_vocab(vocab_key, cache_dir)
+    if vocab is not None:
+        return vocab
+    
+    if corpus_file:
+        sentences = None
+        corpus_file = get_corpus_file(paths, cache_dir, key=key)
+    else:
+        sentences, _ = load_corpus(in_path)
+        corpus_file = None
+    
+    model = word2vec.Word2Vec()
+    total_words, corpus_count = model.scan_vocab(corpus_iterable=sentences,
+                                                 corpus_file=corpus_file)
+    save_vocab(vocab_key, cache_dir, model.raw_vocab, corpus_count, total_words)
+    
+    return {'counts': model.raw_vocab,
+            'corpus_count': corpus_count,
+            'total_words': total_words}
+
+
+def warm_start(model, init_path):
+    """Initializes a model with the vectors of a saved model (e.g. of the
+    previous decade), for the words they share.
+    
+    The vocabulary of `model` (already built) is kept as is: words that are
+    new in its corpus keep their random initialization.
+    
+    Args:
+        model: Word2Vec model with a built vocabulary.
+        init_path: Path to the saved model to start from.
+        
+    Returns:
+        The number of initialized words.
+    """
+    
+    init = word2vec.Word2Vec.load(init_path)
+    if init.vector_size != model.vector_size:
+        raise ValueError('Initial model has different vector dimensions.')
+    if init.hs or model.hs or init.negative != model.negative:
+        raise ValueError('Warm start requires negative sampling in both models.')
+    
+    shared = [w for w in model.wv.index_to_key if w in init.wv.key_to_index]
+    new_ids = np.array([model.wv.key_to_index[w] for w in shared], dtype=int)
+    old_ids = np.array([init.wv.key_to_index[w] for w in shared], dtype=int)
+    
+    model.wv.vectors[new_ids] = init.wv.vectors[old_ids]
+    model.syn1neg[new_ids] = init.syn1neg[old_ids]
+    
+    logging.info(f'Initialized {len(shared)}/{len(model.wv)} words from '
+                 f'{init_path}')
+    
+    return len(shared)
+
+
+def train_model(in_path, out_dir, vector_size=100, window=5, min_count=5,
+                algo='sg', workers=24, corpus_file=False, cache_dir=None,
+                vocab_cache=False, init_model=None, epochs=5):
+    """Trains and saves a word2vec model.
+    
+    Args:
+        in_path: Training data, as accepted by `load_corpus`.
+        out_dir: Directory where to save the model.
+        vector_size: Vector dimensions.
+        window: Window around target.
+        min_count: Minimum frequency.
+        algo: One of ['cbow', 'sg'].
+        workers: Number of worker threads.
+        corpus_file: If true, trains from an uncompressed copy of the corpus
+            (see utils.corpus_cache), which every worker thread reads on its
+            own, instead of a single Python iterator.
+        cache_dir: Directory with the uncompressed copies and vocabulary
+            scans, default DEFAULT_CACHE_DIR.
+        vocab_cache: If true, reuses the word counts of an earlier scan of
+            the same corpus (or caches them for later models).
+        init_model: Path to a saved model (e.g. of the previous decade) to
+            start from, see `warm_start`. The new model then comes out in
+            (nearly) the same space, and needs fewer epochs.
+        epochs: Number of training epochs.
+        
+    Returns:
+        Path to the saved model.
+    """
+    
+    start = time.perf_counter()
+    # Peak memory of this model only, also when a process trains a chain
+    rss_reset = reset_peak_rss()
+    sg = 1 if algo == 'sg' else 0
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    paths = get_corpus_paths(in_path)
+    key = hash_corpus(paths) if corpus_file or vocab_cache else None
     
     logging.info(f'Loading data from: {in_path}')
+    if corpus_file:
+        sentences = None
+        years = get_corpus_years(in_path)
+        corpus_file = get_corpus_file(paths, cache_dir, key=key)
+    else:
+        sentences, years = load_corpus(in_path)
+        corpus_file = None
+    
     logging.info(f"Training: dim {vector_size} - win {window} - "
-                 f"freq {min_count} - algo {algo} - workers {workers}")
+                 f"freq {min_count} - algo {algo} - workers {workers} - "
+                 f"epochs {epochs}")
     
-    # Train model
-    model = word2vec.Word2Vec(sentences,
-                              vector_size=vector_size,
+    model = word2vec.Word2Vec(vector_size=vector_size,
                               window=window,
                               min_count=min_count,
                               sg=sg,
-                              workers=workers)
+                              workers=workers,
+                              epochs=epochs)
+    
+    # Build vocabulary, from the counts of an earlier scan if possible
+    vocab_start = time.perf_counter()
+    prepare_time = vocab_start - start
+    vocab_cached = bool(vocab_cache and os.path.isfile(
+        os.path.join(cache_dir, get_vocab_key(key, corpus_file) + VOCAB_EXT)))
+    if vocab_cache:
+        vocab = get_vocab(in_path, cache_dir, corpus_file=bool(corpus_file),
+                          key=key)
+        model.build_vocab_from_freq(vocab['counts'],
+                                    corpus_count=vocab['corpus_count'])
+        model.corpus_total_words = vocab['total_words']
+    else:
+        model.build_vocab(corpus_iterable=sentences, corpus_file=corpus_file)
+    vocab_time = time.perf_counter() - vocab_start
+    
+    warm_start_time = None
+    if init_model is not None:
+        warm_start_start = time.perf_counter()
+        warm_start(model, init_model)
+        warm_start_time = time.perf_counter() - warm_start_start
+    
+    # Train model
+    timer = EpochTimer()
+    train_start = time.perf_counter()
+    effective_words, raw_words = model.train(corpus_iterable=sentences,
+                                             corpus_file=corpus_file,
+                                             total_examples=model.corpus_count,
+                                             total_words=model.corpus_total_words,
+                                             epochs=model.epochs,
+                                             callbacks=[timer])
+    train_time = time.perf_counter() - train_start
     
     logging.info('Model trained.')
     
     # Save model
-    #corpus = os.path.basename(os.path.normpath(in_path))
-    #corpus = re.search('\d.+\d', corpus).group() # take just the years
-    out_name = f'{years}_d{vector_size}-w{window}-f{min_count}-{algo}.model'
-    out_path = os.path.join(out_path, out_name)
+    out_name = get_model_name(years, vector_size, window, min_count, algo)
+    out_path = os.path.join(out_dir, out_name)
     model.save(out_path)
     
     logging.info(f'Model saved to {out_path}')
     
+    # Lean copy of the vectors, for the feature scripts
+    store_path = get_store_path(out_path)
+    if os.path.isdir(store_path):
+        shutil.rmtree(store_path)
+    export_store(model.wv, store_path, name=out_name)
+    
+    logging.info(f'Vectors exported to {store_path}')
+    
+    # Metrics, to compare configurations and catch slow trainings
+    metrics = {'model': out_name,
+               'corpus': {'paths': paths,
+                          'bytes': get_corpus_bytes(paths),
+                          'n_sents': model.corpus_count,
+                          'n_words': model.corpus_total_words},
+               'params': {'vector_size': vector_size,
+                          'window': window,
+                          'min_count': min_count,
+                          'algo': algo,
+                          'epochs': epochs,
+                          'workers': workers,
+                          'corpus_file': corpus_file is not None,
+                          'init_model': init_model},
+               'vocab': {'size': len(model.wv),
+                         'cached': vocab_cached,
+                         'build_time_s': vocab_time},
+               'train': {'prepare_time_s': prepare_time,
+                         'warm_start_time_s': warm_start_time,
+                         'time_s': train_time,
+                         'epoch_times_s': timer.epoch_times,
+                         'raw_words': raw_words,
+                         'effective_words': effective_words,
+                         'effective_words_per_s': effective_words / train_time},
+               'peak_rss_mb': get_peak_rss(),
+               'peak_rss_scope': 'model' if rss_reset else 'process',
+               'total_time_s': time.perf_counter() - start}
+    metrics_path = os.path.splitext(out_path)[0] + METRICS_EXT
+    with open(metrics_path, 'w') as f:
+        json.dump(metrics, f, indent=2)
+    
+    logging.info(f'Metrics written to {metrics_path}: '
+                 f"{metrics['train']['effective_words_per_s']:.0f} "
+                 f"effective words/s")
+    
+    return out_path
+
+
+def main():
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus_path', help='directory or single corpus files '
+                        f'(text, or columnar {COLS_EXT} corpora)')
+    parser.add_argument('model_path', help='directory where to save model')
+    parser.add_argument('--dims', help='vector dimensions, default 100',
+                        default=100, type=int)
+    parser.add_argument('--win', help='window around target, default 5',
+                        default=5, type=int)
+    parser.add_argument('--freq', help='minimum frequency, default 5',
+                        default=5, type=int)
+    parser.add_argument('--algo', help="one of ['cbow', 'sg'], default 'sg'",
+                        default='sg', choices=['cbow', 'sg'])
+    parser.add_argument('--work', help='number of workers, default 24',
+                        default=24, type=int)
+    parser.add_argument('--corpus_file', help='train from an uncompressed, '
+                        'cached copy of the corpus (scales with --work)',
+                        action='store_true')
+    parser.add_argument('--cache_dir', help='directory for uncompressed corpus '
+                        f'copies, default {DEFAULT_CACHE_DIR}',
+                        default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--vocab_cache', help='cache the word counts of the '
+                        'vocabulary scan in --cache_dir, and reuse those of an '
+                        'earlier scan of the same corpus', action='store_true')
+    parser.add_argument('--init_model', help='saved model (e.g. of the previous '
+                        'decade) to initialize shared words from')
+    parser.add_argument('--epochs', help='number of training epochs, default 5',
+                        default=5, type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+    
+    train_model(args.corpus_path, args.model_path,
+                vector_size=args.dims,
+                window=args.win,
+                min_count=args.freq,
+                algo=args.algo,
+                workers=args.work,
+                corpus_file=args.corpus_file,
+                cache_dir=args.cache_dir,
+                vocab_cache=args.vocab_cache,
+                init_model=args.init_model,
+                epochs=args.epochs)
+    
     
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,256 @@
+"""Trains the full set of fine-grained (decade) and coarse-grained (30-year)
+word2vec models, for several runs and hyperparameter settings, sharing a CPU
+budget between concurrent trainings."""
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+
+from w2v_train import (DEFAULT_CACHE_DIR, get_corpus_paths, get_corpus_years,
+                       get_model_name, get_vocab, train_model)
+
+import sys
+sys.path.append('../')
+from utils.columnar_corpus import COLS_EXT
+from utils.corpus_cache import get_corpus_file
+
+
+def get_corpus_files(corpus_dir, first=None, last=None):
+    """Lists decade-level corpus files, preferring columnar corpora.
+
+    Args:
+        corpus_dir: Directory with decade-level corpus files.
+        first: If set, decades before it are left out.
+        last: If set, decades after it are left out.
+
+    Returns:
+        A dictionary from decade (int) to path, sorted by decade.
+    """
+
+    in_files = sorted(os.listdir(corpus_dir))
+    cols_files = [f for f in in_files if f.endswith(COLS_EXT)]
+    in_files = cols_files or [f for f in in_files if f.endswith('.txt.gz')]
+
+    decades = {int(re.search(r'\d+', f).group()): os.path.join(corpus_dir, f)
+               for f in in_files}
+    decades = {d: path for d, path in decades.items()
+               if (first is None or d >= first) and (last is None or d <= last)}
+
+    return dict(sorted(decades.items()))
+
+
+def get_spans(decades, span=30, first=None):
+    """Groups decades into consecutive spans of `span` years, starting at
+    `first` (default: the first decade).
+
+    Returns:
+        A list of lists of decades, e.g. [[1830, 1840, 1850], ...].
+    """
+
+    first = min(decades) if first is None else first
+    spans = {}
+    for decade in decades:
+        spans.setdefault((decade - first) // span, []).append(decade)
+
+    return [spans[k] for k in sorted(spans)]
+
+
+def plan_jobs(corpus_files, fine_dir, coarse_dir, runs, grid, span=30,
+              epochs=5, warm_epochs=None, first=None):
+    """Lists every model to train, skipping those that already exist.
+
+    Args:
+        corpus_files: Dictionary from decade to corpus path.
+        fine_dir: Main directory for fine-grained models.
+        coarse_dir: Main directory for coarse-grained models.
+        runs: Number of training runs.
+        grid: List of (vector_size, window, min_count, algo) settings.
+        span: Number of years per coarse-grained model.
+        first: First decade of the first coarse-grained span (default: the
+            first decade of corpus_files).
+        epochs: Number of epochs of models trained from scratch.
+        warm_epochs: If set, every model of a run, grain and setting is warm
+            started from the previous one (see w2v_train.warm_start), and
+            trained for this number of epochs.
+
+    Returns:
+        A list of jobs, coarse-grained first (as the larger jobs are best
+        scheduled early). Each job is a list of (in_path, out_dir, params,
+        init_path, epochs) steps to train in order: a single step, or the
+        chain of models of a run, grain and setting when warm starting.
+    """
+
+    grains = []
+    if coarse_dir is not None:
+        inputs = [[corpus_files[d] for d in decades]
+                  for decades in get_spans(corpus_files, span=span, first=first)]
+        grains.append((inputs, coarse_dir))
+    if fine_dir is not None:
+        grains.append((list(corpus_files.values()), fine_dir))
+
+    jobs = []
+    for run in range(1, runs + 1):
+        for inputs, main_dir in grains:
+            out_dir = os.path.join(main_dir, f'run{run}')
+            for params in grid:
+                chain = []
+                init_path = None
+                for in_path in inputs:
+                    out_name = get_model_name(get_corpus_years(in_path), *params)
+                    out_path = os.path.join(out_dir, out_name)
+                    if os.path.isfile(out_path):
+                        logging.info(f'Skipping existing model: {out_path}')
+                    elif init_path is None:
+                        chain.append((in_path, out_dir, params, None, epochs))
+                    else:
+                        chain.append((in_path, out_dir, params, init_path,
+                                      warm_epochs))
+                    if warm_epochs is not None:
+                        init_path = out_path
+                if warm_epochs is not None:
+                    if chain:
+                        jobs.append(chain)
+                else:
+                    jobs.extend([step] for step in chain)
+
+    # Stable sort keeps the run/decade order within each grain
+    jobs.sort(key=lambda job: not isinstance(job[0][0], list))
+
+    return jobs
+
+
+def _cache_job(job):
+    """Builds the uncompressed copy and/or vocabulary scan of one corpus."""
+
+    in_path, cache_dir, corpus_file, vocab_cache = job
+    if corpus_file:
+        get_corpus_file(get_corpus_paths(in_path), cache_dir)
+    if vocab_cache:
+        get_vocab(in_path, cache_dir, corpus_file=corpus_file)
+
+
+def _train_job(job):
+    """Trains the models of one job from `plan_jobs` in a worker process.
+
+    Returns:
+        Path to the last saved model.
+    """
+
+    steps, options = job
+    for in_path, out_dir, params, init_path, epochs in steps:
+        vector_size, window, min_count, algo = params
+        os.makedirs(out_dir, exist_ok=True)
+        out_path = train_model(in_path, out_dir,
+                               vector_size=vector_size,
+                               window=window,
+                               min_count=min_count,
+                               algo=algo,
+                               init_model=init_path,
+                               epochs=epochs,
+                               **options)
+
+    return out_path
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('corpus_dir', help='directory with decade-level '
+                        f'corpus files (.txt.gz or {COLS_EXT})')
+    parser.add_argument('--fine_dir', help='main directory for fine-grained '
+                        'models (run<N> subdirectories are created)')
+    parser.add_argument('--coarse_dir', help='main directory for coarse-grained '
+                        'models (run<N> subdirectories are created)')
+    parser.add_argument('--runs', help='number of training runs, default 5',
+                        default=5, type=int)
+    parser.add_argument('--span', help='years per coarse-grained model, '
+                        'default 30', default=30, type=int)
+    parser.add_argument('--first', help='first decade to train (and start of '
+                        'the first coarse-grained span), default 1830',
+                        default=1830, type=int)
+    parser.add_argument('--last', help='last decade to train, default 2000',
+                        default=2000, type=int)
+    parser.add_argument('--dims', help='vector dimensions, default 100',
+                        default=[100], type=int, nargs='+')
+    parser.add_argument('--win', help='window around target, default 10',
+                        default=[10], type=int, nargs='+')
+    parser.add_argument('--freq', help='minimum frequency, default 1',
+                        default=[1], type=int, nargs='+')
+    parser.add_argument('--algo', help="'cbow' and/or 'sg', default 'sg'",
+                        default=['sg'], choices=['cbow', 'sg'], nargs='+')
+    parser.add_argument('--cpus', help='total CPU budget, default: all cores',
+                        default=os.cpu_count(), type=int)
+    parser.add_argument('--parallel', help='number of concurrent trainings, '
+                        'default: one per 8 CPUs', type=int)
+    parser.add_argument('--corpus_file', help='train from uncompressed, cached '
+                        'copies of the corpora (see w2v_train.py)',
+                        action='store_true')
+    parser.add_argument('--cache_dir', help='directory for uncompressed corpus '
+                        f'copies, default {DEFAULT_CACHE_DIR}',
+                        default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--vocab_cache', help='cache the word counts of the '
+                        'vocabulary scan of every corpus in --cache_dir, so a '
+                        'sweep over settings scans it only once',
+                        action='store_true')
+    parser.add_argument('--epochs', help='number of training epochs, default 5',
+                        default=5, type=int)
+    parser.add_argument('--warm_start', help='warm start every model from the '
+                        'previous decade (span) of the same run and setting, '
+                        'training it for N epochs', metavar='N', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+
+    if args.fine_dir is None and args.coarse_dir is None:
+        parser.error('at least one of --fine_dir and --coarse_dir is required')
+
+    # Every combination of hyperparameters
+    grid = list(itertools.product(args.dims, args.win, args.freq, args.algo))
+
+    corpus_files = get_corpus_files(args.corpus_dir, args.first, args.last)
+    jobs = plan_jobs(corpus_files, args.fine_dir, args.coarse_dir, args.runs,
+                     grid, span=args.span, epochs=args.epochs,
+                     warm_epochs=args.warm_start, first=args.first)
+    n_models = sum(len(job) for job in jobs)
+
+    # gensim's throughput levels off beyond a handful of threads per model,
+    # so the CPU budget is split between several concurrent trainings
+    parallel = args.parallel or max(1, args.cpus // 8)
+    parallel = max(1, min(parallel, len(jobs)))
+    workers = max(1, args.cpus // parallel)
+
+    logging.info(f'Training {n_models} models in {len(jobs)} jobs, {parallel} '
+                 f'at a time with {workers} workers each.')
+
+    vocab_cache = args.vocab_cache
+    if args.corpus_file or vocab_cache:
+        # Corpus copies and vocabulary scans are built once up front, rather
+        # than by every concurrent training on the same data
+        inputs = []
+        for job in jobs:
+            for in_path, _, _, _, _ in job:
+                if in_path not in inputs:
+                    inputs.append(in_path)
+        cache_jobs = [(in_path, args.cache_dir, args.corpus_file, vocab_cache)
+                      for in_path in inputs]
+        with multiprocessing.Pool(parallel) as pool:
+            for _ in pool.imap_unordered(_cache_job, cache_jobs):
+                pass
+
+    options = {'workers': workers,
+               'corpus_file': args.corpus_file,
+               'cache_dir': args.cache_dir,
+               'vocab_cache': vocab_cache}
+    jobs = [(job, options) for job in jobs]
+    with multiprocessing.Pool(parallel, maxtasksperchild=1) as pool:
+        for i, out_path in enumerate(pool.imap_unordered(_train_job, jobs)):
+            logging.info(f'Finished {i+1}/{len(jobs)} jobs: {out_path}')
+
+    logging.info('Done.')
+
+
+if __name__ == '__main__':
+    main()
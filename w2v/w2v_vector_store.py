@@ -0,0 +1,199 @@
+"""Lean, memory-mapped export of trained word2vec vectors for feature scripts.
+
+A store is a directory next to the model (`<model name>.vectors`) with:
+    keys.txt      vocabulary, one key per line, in model order
+    vectors.npy   word vectors
+    normed.npy    L2-normalized word vectors
+    norms.npy     L2 norms of the word vectors
+    counts.npy    corpus counts of the keys
+    meta.json     vector size, model name and content hash
+
+Unlike `Word2Vec.load()`, loading a store does not deserialize the training
+state (`syn1neg`, `cum_table`, ...) and maps the arrays read-only, so loading is
+near-instant and processes reading the same store share its pages.
+
+Usage:
+    python w2v_vector_store.py <model_dir>
+exports a store for every model in <model_dir> that does not have one yet.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import weakref
+
+import numpy as np
+from gensim.models import KeyedVectors, Word2Vec
+
+STORE_EXT = '.vectors'
+
+# Content hashes of KeyedVectors, with the vectors they were computed for
+# (kept off the objects, which would otherwise pickle them with the model)
+_content_hashes = weakref.WeakKeyDictionary()
+
+
+def get_store_path(model_path):
+    """Returns the store path of a saved model (`<name>.model`)."""
+
+    root, ext = os.path.splitext(model_path)
+
+    return (root if ext == '.model' else model_path) + STORE_EXT
+
+
+def hash_vectors(wv):
+    """Returns the hex digest of the keys and vectors of a KeyedVectors.
+
+    The hash is kept on `wv` until its vectors are replaced, and is read from
+    the metadata for stores.
+    """
+
+    cached = _content_hashes.get(wv)
+    if cached is not None and cached[0] is wv.vectors:
+        return cached[1]
+
+    h = hashlib.sha1()
+    h.update('\n'.join(wv.index_to_key).encode('utf-8') + b'\0')
+    h.update(str(wv.vectors.dtype).encode() + b'\0')
+    h.update(np.ascontiguousarray(wv.vectors))
+    digest = h.hexdigest()
+    _content_hashes[wv] = (wv.vectors, digest)
+
+    return digest
+
+
+def export_store(wv, out_path, name=''):
+    """Writes the vectors and counts of a model's KeyedVectors to a store.
+
+    Args:
+        wv: Trained KeyedVectors (`model.wv`).
+        out_path: Store directory to create.
+        name: Name of the model, kept in the metadata.
+    """
+
+    if os.path.exists(out_path):
+        raise ValueError('Output store already exists.')
+
+    vectors = np.asarray(wv.vectors)
+    norms = np.linalg.norm(vectors, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normed = vectors / norms[:, np.newaxis]
+    normed[norms == 0] = 0
+    counts = np.array([wv.get_vecattr(w, 'count') for w in wv.index_to_key],
+                      dtype=np.int64)
+
+    # Written to a temporary directory, so that a store is complete or absent
+    tmp_path = f'{out_path}.{os.getpid()}.tmp'
+    os.mkdir(tmp_path)
+    try:
+        with open(os.path.join(tmp_path, 'keys.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(w + '\n' for w in wv.index_to_key)
+        np.save(os.path.join(tmp_path, 'vectors.npy'), vectors)
+        np.save(os.path.join(tmp_path, 'normed.npy'), normed.astype(vectors.dtype))
+        np.save(os.path.join(tmp_path, 'norms.npy'), norms.astype(vectors.dtype))
+        np.save(os.path.join(tmp_path, 'counts.npy'), counts)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'name': name, 'vector_size': int(wv.vector_size),
+                       'content_hash': hash_vectors(wv)}, f)
+        os.rename(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+
+class StoredKeyedVectors(KeyedVectors):
+    """KeyedVectors backed by the memory-mapped arrays of a store.
+
+    Norms and unit vectors are read from the store rather than recomputed,
+    as long as `vectors` has not been replaced (e.g. by an alignment).
+    """
+
+    @classmethod
+    def load_store(cls, path, mmap_mode='r'):
+        """Loads a store written by `export_store`."""
+
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        with open(os.path.join(path, 'keys.txt'), 'r', encoding='utf-8') as f:
+            keys = [w.rstrip('\n') for w in f]
+        vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode=mmap_mode)
+
+        wv = cls(meta['vector_size'], count=0, dtype=vectors.dtype)
+        wv.vectors = vectors
+        wv.index_to_key = keys
+        wv.key_to_index = {w: i for i, w in enumerate(keys)}
+        wv.expandos['count'] = np.load(os.path.join(path, 'counts.npy'),
+                                       mmap_mode=mmap_mode)
+        wv.store_path = path
+        if 'content_hash' in meta:
+            _content_hashes[wv] = (vectors, meta['content_hash'])
+        wv.store_vectors = vectors
+        wv.store_normed = np.load(os.path.join(path, 'normed.npy'),
+                                  mmap_mode=mmap_mode)
+        wv.store_norms = np.load(os.path.join(path, 'norms.npy'),
+                                 mmap_mode=mmap_mode)
+
+        return wv
+
+    def _from_store(self):
+        return getattr(self, 'store_vectors', None) is self.vectors
+
+    def fill_norms(self, force=False):
+        if self.norms is None and not force and self._from_store():
+            self.norms = self.store_norms
+        super().fill_norms(force=force)
+
+    def get_normed_vectors(self):
+        if self._from_store():
+            return self.store_normed
+
+        return super().get_normed_vectors()
+
+
+class VectorStore:
+    """Model-like wrapper (with a `wv` attribute) around a loaded store, so
+    that feature code written for Word2Vec models works unchanged."""
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        self.wv = StoredKeyedVectors.load_store(path, mmap_mode=mmap_mode)
+
+
+def load_vectors(model_path, mmap_mode='r'):
+    """Loads the vectors of a saved model, from its store if it has one.
+
+    Returns:
+        A VectorStore, or the full Word2Vec model if no store was exported.
+    """
+
+    store_path = get_store_path(model_path)
+    if os.path.isdir(store_path):
+        return VectorStore(store_path, mmap_mode=mmap_mode)
+
+    return Word2Vec.load(model_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_dir', help='directory with saved w2v models')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+
+    model_files = sorted(m for m in os.listdir(args.model_dir)
+                         if m.endswith('model'))
+    for model_file in model_files:
+        model_path = os.path.join(args.model_dir, model_file)
+        store_path = get_store_path(model_path)
+        if os.path.isdir(store_path):
+            logging.info(f'Skipping existing store: {store_path}')
+            continue
+        model = Word2Vec.load(model_path)
+        export_store(model.wv, store_path, name=model_file)
+        logging.info(f'Exported {len(model.wv)} vectors to {store_path}')
+
+
+if __name__ == '__main__':
+    main()